@@ -1,24 +1,18 @@
 # Sentence similarity
 
-from sentence_transformers import SentenceTransformer
 from scipy.spatial.distance import cosine
 from ner import NER
 from entity_linking import EL
-import re
 import numpy as np
-import wikipediaapi
-import spacy
-from scipy.spatial.distance import cdist
+import kb
+import kb_backend
+import similarity
+import model_registry
+import nlp_service
 
 
 def get_wikipedia_text(page_title: str) -> str:
-    wiki = wikipediaapi.Wikipedia(
-        language="en",
-        extract_format=wikipediaapi.ExtractFormat.WIKI,
-        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-    )
-    page = wiki.page(page_title)
-    return page.text
+    return kb.fetch_wikipedia_text(page_title)
 
 
 def find_sentences_with_word(text, keyword):
@@ -30,40 +24,25 @@ def find_sentences_with_word(text, keyword):
 
 
 def split_sentences(text):
-    sentence_endings = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!|。|！|？)(?=\s|$)"
-    sentences = re.split(sentence_endings, text)
-    return [sentence.strip() for sentence in sentences if sentence.strip()]
+    return kb_backend.split_sentences(text)
 
 
 def efficient_similarity_calculation(
     text_list: list, target_text: str, top_k: int = 3, batch_size: int = 32
 ):
-    model = SentenceTransformer("all-distilroberta-v1")
-    # model = SentenceTransformer('all-mpnet-base-v2')  # 可更换
+    model = model_registry.get_sentence_transformer("all-distilroberta-v1")
+    # model = model_registry.get_sentence_transformer('all-mpnet-base-v2')  # 可更换
 
-    target_embedding = model.encode([target_text], show_progress_bar=False)
-    text_embeddings = model.encode(
+    target_embedding = similarity.normalize(model.encode([target_text], show_progress_bar=False))[0]
+    text_embeddings = similarity.normalize(model.encode(
         text_list, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True
-    )
+    ))
 
-    similarities = 1 - cdist(text_embeddings, target_embedding, metric="cosine")
-    similarities = similarities.flatten()
-
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
-
-    results = [
-        {"text": text_list[idx], "similarity": float(similarities[idx])}
-        for idx in top_indices
-    ]
-
-    return results
-
-
-nlp = spacy.load("en_core_web_md")
+    return similarity.top_k_evidence(text_list, text_embeddings, target_embedding, top_k)
 
 
 def extract_adjectives(text: str) -> list:
-    doc = nlp(text)
+    doc = nlp_service.parse(text, "en_core_web_md", disable=nlp_service.SYNTAX_DISABLE)
     results = []
     for token in doc:
         if token.pos_ == "NOUN" and not token.ent_type_:
@@ -1,20 +1,44 @@
 from question_classifier import Question_classifier
 from transformers import pipeline
 from difflib import SequenceMatcher
-from judge import BoolQPredictor
+import model_registry
+import tracing
 
 class Answer_extract:
-    def __init__(self):
+    def __init__(self, boolq_model_path="yes_no_model.pkl", qa_backend="torch", boolq_backend="torch"):
+        """qa_backend / boolq_backend: "torch", "onnx" or "onnx-int8" (see onnx_backend)"""
         self.question_classifier = Question_classifier()
-        self.qa_pipeline = pipeline("question-answering", model="distilbert-base-cased-distilled-squad")
+        qa_model = "distilbert-base-cased-distilled-squad"
+        if qa_backend == "torch":
+            self.qa_pipeline = pipeline("question-answering", model=qa_model)
+        else:
+            import onnx_backend
+            from transformers import AutoTokenizer
+            self.qa_pipeline = pipeline(
+                "question-answering",
+                model=onnx_backend.load(qa_model, "question-answering", qa_backend),
+                tokenizer=AutoTokenizer.from_pretrained(qa_model)
+            )
+        self.boolq_model_path = boolq_model_path
+        self.boolq_backend = boolq_backend
 
+    @property
+    def predictor(self):
+        """BoolQPredictor shared through the model registry, loaded on the first yes/no question"""
+        return model_registry.get_boolq_predictor(self.boolq_model_path, self.boolq_backend)
+
+    def predictor_stats(self):
+        """Load and prediction timings of the yes/no predictor, None if it was never needed"""
+        predictor = model_registry.get_loaded(("boolq", self.boolq_model_path, self.boolq_backend))
+        return predictor.stats() if predictor is not None else None
+
+    @tracing.traced("ae.extract")
     def extract(self, question, answer, linked_entities):
         question_category = self.question_classifier.question_classify(question)
 
         # a yes/no question
         if question_category == 1:
-            predictor = BoolQPredictor("yes_no_model.pkl")
-            result = predictor.predict(question, answer)
+            result = self.predictor.predict(question, answer)
             # print("I am the result for question one: "+str(result))
             return result['answer']  # return Yes or No; result['confidence'] for confidence
 
@@ -33,6 +57,37 @@ class Answer_extract:
                 return 0
             
         return 0
+
+    @tracing.traced("ae.extract_batch")
+    def extract_batch(self, questions, answers, linked_entities_list, batch_size=16):
+        """extract() for lists of questions, running each model once over its whole category"""
+        results = [0] * len(questions)
+        categories = [self.question_classifier.question_classify(q) for q in questions]
+
+        # yes/no questions
+        yes_no = [i for i, c in enumerate(categories) if c == 1]
+        if yes_no:
+            predictions = self.predictor.predict_batch(
+                [questions[i] for i in yes_no], [answers[i] for i in yes_no], batch_size=batch_size
+            )
+            for i, prediction in zip(yes_no, predictions):
+                results[i] = prediction['answer']
+
+        # other questions
+        others = [i for i, c in enumerate(categories) if c == 2]
+        if others:
+            qa_results = self.qa_pipeline(
+                question=[questions[i] for i in others],
+                context=[answers[i] for i in others],
+                batch_size=batch_size
+            )
+            if isinstance(qa_results, dict):
+                qa_results = [qa_results]
+            for i, qa_result in zip(others, qa_results):
+                matched_entity = self.fuzzy_match(qa_result["answer"], linked_entities_list[i])
+                results[i] = matched_entity if matched_entity else 0
+
+        return results
     
     def fuzzy_match(self, answer, linked_entities, threshold=0.7):
         best_match = None
@@ -0,0 +1,262 @@
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import kb_cache
+import model_registry
+import runner
+import tracing
+
+# End-to-end benchmark that runs without the network. `record` runs the questions once
+# online and keeps every knowledge base / Wikipedia response (in a kb_cache database
+# whose entries never expire) and every LLM answer. `run` replays them offline against
+# a copy of that database, with the LLM replaced by the recorded answers (or a small
+# GGUF), and appends questions/s, per-stage latency and peak RSS to a results file
+# together with the git commit, so `compare` can show what changed between commits.
+
+DEFAULT_BENCH_DIR = os.environ.get("WDPS_BENCH_DIR", os.path.expanduser("~/.cache/wdps/bench"))
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "input_and_output", "example_input.txt")
+
+
+def _fixture_files(fixtures):
+    return os.path.join(fixtures, "kb_cache.sqlite"), os.path.join(fixtures, "llm_answers.json")
+
+
+class RecordingLLM:
+    """Wraps an LLM and keeps every answer it gives"""
+    def __init__(self, llm):
+        self.llm = llm
+        self.answers = {}
+
+    def ask(self, question, prompt=True):
+        output = self.llm.ask(question, prompt)
+        self.answers[question] = output[0]["text"]
+        return output
+
+
+class ReplayLLM:
+    """Stands in for LLM with recorded answers, optionally waiting `delay` seconds per answer"""
+    def __init__(self, answers, delay=0.0):
+        self.answers = answers
+        self.delay = delay
+        self.missing = 0
+
+    @tracing.traced("llm.ask")
+    def ask(self, question, prompt=True):
+        if self.delay:
+            time.sleep(self.delay)
+        if question not in self.answers:
+            self.missing += 1
+        return [{"text": self.answers.get(question, "")}]
+
+
+def _questions(path, limit):
+    questions = list(runner.iter_questions(path))
+    return questions[:limit] if limit else questions
+
+
+def record(path=DEFAULT_QUESTIONS, fixtures=DEFAULT_BENCH_DIR, limit=None, prompt=False):
+    """Run the questions online once, keeping every KB response and LLM answer as fixtures"""
+    from llm import LLM
+    from run_task1 import Task
+
+    os.makedirs(fixtures, exist_ok=True)
+    cache_path, answers_path = _fixture_files(fixtures)
+    # ttl 0: recorded responses never expire
+    kb_cache.configure(path=cache_path, ttl=0, offline=False)
+    llm = RecordingLLM(LLM())
+    task = Task(llm=llm, embedding_store=None)
+    for question_id, question in _questions(path, limit):
+        # the single and the batched path fetch the same things, so one pass covers both
+        result = task.process([question], prompt)[0]
+        if isinstance(result, Exception):
+            print(f"Error processing question ID {question_id}: {result}")
+    with open(answers_path, "w") as f:
+        json.dump({"prompt": prompt, "answers": llm.answers}, f, indent=2, ensure_ascii=False)
+    print(f"Recorded {len(llm.answers)} answers and {kb_cache.get_cache().stats()['entries']} KB responses to {fixtures}")
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() != ""
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children covers forked workers
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run(path=DEFAULT_QUESTIONS, fixtures=DEFAULT_BENCH_DIR, mode="single", batch_size=8, workers=2,
+        llm="replay", llm_delay=0.0, limit=None, results_path=None, label=""):
+    """
+    Replay the recorded questions offline and return (and append to results_path) one result record.
+    mode: "single" (Task.run per question), "batch" (run_batch, batch_size questions at a time),
+    "pipeline" (pipeline.run) or "workers" (worker_pool.run with `workers` processes).
+    llm: "replay" for the recorded answers, or the path of a GGUF model to run for real.
+    """
+    from run_task1 import Task
+
+    cache_path, answers_path = _fixture_files(fixtures)
+    if not os.path.isfile(cache_path):
+        raise FileNotFoundError(f"No fixtures in {fixtures}, run `python bench.py record` first")
+    with open(answers_path) as f:
+        recorded = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # replay against a copy, so the run never changes the fixtures
+        replay_cache = os.path.join(tmp, "kb_cache.sqlite")
+        # (sqlite's backup also picks up what is still in the fixture's WAL file)
+        source, copy = sqlite3.connect(cache_path), sqlite3.connect(replay_cache)
+        source.backup(copy)
+        # keep the KB responses but not the cached BERT embeddings, so ranking is measured too
+        with copy:
+            copy.execute("DELETE FROM cache WHERE namespace = 'bert_embedding'")
+        source.close()
+        copy.close()
+        kb_cache.configure(path=replay_cache, offline=True)
+        tracing.drain()
+
+        start = time.perf_counter()
+        if llm == "replay":
+            stand_in = ReplayLLM(recorded["answers"], delay=llm_delay)
+        else:
+            from llm import LLM
+            stand_in = LLM(llm)
+        task = Task(llm=stand_in, embedding_store=os.path.join(tmp, "sentence_embeddings"))
+        task.ae.predictor
+        init_seconds = time.perf_counter() - start
+
+        questions = _questions(path, limit)
+        writer = runner.ResultWriter(os.path.join(tmp, "output.txt"))
+        prompt = recorded["prompt"]
+        start = time.perf_counter()
+        if mode == "pipeline":
+            import pipeline
+            pipeline.run(task, questions, writer, prompt)
+        elif mode == "workers":
+            import worker_pool
+            worker_pool.run(task, questions, writer, workers, batch_size, prompt)
+        else:
+            size = batch_size if mode == "batch" else 1
+            for batch in runner.batched(questions, size):
+                question_ids, question_texts = zip(*batch)
+                with tracing.question(question_ids[0] if size == 1 else list(question_ids)):
+                    results = task.process(question_texts, prompt)
+                writer.write_batch(question_ids, results)
+        seconds = time.perf_counter() - start
+        writer.close()
+
+    summary = tracing.summary(tracing.drain())
+    result = {
+        "label": label,
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "mode": mode,
+        "batch_size": batch_size if mode in ("batch", "workers") else 1,
+        "workers": workers if mode == "workers" else 1,
+        "llm": llm,
+        "questions": len(questions),
+        "answered": len(writer.finished),
+        "seconds": seconds,
+        "questions_per_second": len(questions) / seconds if seconds else None,
+        "init_seconds": init_seconds,
+        "model_loads": model_registry.load_events,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": {name: {"count": s["count"], **{k: s["wall"][k] for k in ("mean", "p50", "p95", "p99")}}
+                   for name, s in summary["stages"].items()},
+        "counters": summary["counters"],
+    }
+    misses = summary["counters"].get("kb_offline_misses", 0)
+    if misses:
+        print(f"Warning: {misses} lookups were not in the fixtures, record them again for a faithful replay")
+    if results_path:
+        os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+        with open(results_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    return result
+
+
+def compare(results_path, threshold=0.1, mode=None):
+    """Print the latest result next to the previous one of the same mode/settings, flagging slowdowns above threshold"""
+    with open(results_path) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    if mode:
+        results = [r for r in results if r["mode"] == mode]
+    if not results:
+        print("No results")
+        return
+    latest = results[-1]
+    same = [r for r in results[:-1] if (r["mode"], r["batch_size"], r["workers"], r["llm"], r["questions"]) ==
+            (latest["mode"], latest["batch_size"], latest["workers"], latest["llm"], latest["questions"])]
+    if not same:
+        print("Nothing to compare with")
+        return
+    previous = same[-1]
+    print(f"{previous['commit']} -> {latest['commit']} ({latest['mode']}, {latest['questions']} questions)")
+
+    def line(name, before, after, higher_is_better=False):
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  <-- regression" if worse > threshold else ""
+        print(f"  {name:28s} {before:10.4f} -> {after:10.4f} ({change:+.1%}){flag}")
+
+    line("questions/s", previous["questions_per_second"], latest["questions_per_second"], higher_is_better=True)
+    line("peak RSS (MB)", previous["peak_rss_mb"]["self"], latest["peak_rss_mb"]["self"])
+    for name in latest["stages"]:
+        if name in previous["stages"]:
+            line(f"{name} p50 (s)", previous["stages"][name]["p50"], latest["stages"][name]["p50"])
+            line(f"{name} p95 (s)", previous["stages"][name]["p95"], latest["stages"][name]["p95"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with recorded fixtures")
+    parser.add_argument("command", choices=["record", "run", "compare"])
+    parser.add_argument("--path", "-p", type=str, default=DEFAULT_QUESTIONS, help="the questions to benchmark with")
+    parser.add_argument("--fixtures", type=str, default=DEFAULT_BENCH_DIR, help="directory of the recorded fixtures")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N questions")
+    parser.add_argument("--prompt", action="store_true", help="record with the question answering prompt")
+    parser.add_argument("--mode", type=str, choices=["single", "batch", "pipeline", "workers"], default=None,
+                        help="run: execution mode (default: single, then batch); compare: only this mode")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--llm", type=str, default="replay",
+                        help="'replay' for the recorded answers or the path of a (small) GGUF model")
+    parser.add_argument("--llm_delay", type=float, default=0.0,
+                        help="seconds the replayed LLM waits per answer, to mimic generation time")
+    parser.add_argument("--results", type=str, default=os.path.join(DEFAULT_BENCH_DIR, "results.jsonl"),
+                        help="JSONL file the results are appended to")
+    parser.add_argument("--label", type=str, default="", help="free text stored with the result")
+    parser.add_argument("--threshold", type=float, default=0.1, help="compare: relative slowdown flagged as regression")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path, args.fixtures, args.limit, args.prompt)
+    elif args.command == "run" and not args.mode:
+        # one process per mode, so peak RSS and model loads are measured separately
+        for mode in ["single", "batch"]:
+            subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--mode", mode], check=True)
+    elif args.command == "run":
+        result = run(args.path, args.fixtures, args.mode, args.batch_size, args.workers, args.llm, args.llm_delay,
+                     args.limit, args.results, args.label)
+        print(json.dumps({k: result[k] for k in ("mode", "questions", "seconds", "questions_per_second",
+                                                 "peak_rss_mb", "stages")}, indent=2))
+    else:
+        compare(args.results, args.threshold, args.mode)
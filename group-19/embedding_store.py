@@ -0,0 +1,183 @@
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from similarity import normalize
+
+# segments a page may have before they are merged into one
+MAX_SEGMENTS = 16
+DEFAULT_STORE_PATH = os.environ.get("WDPS_EMBEDDING_STORE", os.path.expanduser("~/.cache/wdps/sentence_embeddings"))
+
+
+def _sentence_hash(sentence):
+    return hashlib.sha1(sentence.encode("utf-8")).hexdigest()[:16]
+
+
+class SentenceEmbeddingStore:
+    """
+    Persistent L2-normalised sentence embeddings keyed by (page title, sentence hash).
+    A page is a series of immutable segment files under path/<model name>/, each a .npy
+    array of (sentence hash, float16 vector) records that is memory-mapped when read.
+    Sentences that are not stored yet are encoded with `encode` (list of texts -> array)
+    and written as a new segment holding only those rows, under a file lock after
+    picking up the segments other processes (e.g. forked workers) added meanwhile, so
+    nothing is rewritten and no row is lost. Segments appear with one os.replace, so
+    readers never see half of one. At most cache_size pages stay mapped in memory (LRU).
+    """
+    def __init__(self, encode, model_name, path=DEFAULT_STORE_PATH, cache_size=256):
+        self.encode = encode
+        self.dir = os.path.join(path, re.sub(r"[^\w.-]", "_", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.cache_size = cache_size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, title):
+        return hashlib.sha1(title.encode("utf-8")).hexdigest()
+
+    def _segment_files(self, title):
+        """{sequence number: file} of the page's segments on disk"""
+        pattern = re.compile(re.escape(self._key(title)) + r"\.(\d+)\.npy$")
+        files = {}
+        for name in os.listdir(self.dir):
+            match = pattern.match(name)
+            if match:
+                files[int(match.group(1))] = os.path.join(self.dir, name)
+        return files
+
+    def _refresh(self, title, page):
+        """Map the segments of the page that are not in `page` yet"""
+        for number, segment_file in sorted(self._segment_files(title).items()):
+            if number in page["seen"]:
+                continue
+            page["seen"].add(number)
+            try:
+                segment = np.load(segment_file, mmap_mode="r")
+            except FileNotFoundError:
+                continue  # merged into a newer segment meanwhile, see _compact
+            except (OSError, ValueError):
+                segment = None
+            if segment is None or segment.dtype.names != ("hash", "vector"):
+                print(f"Ignoring unreadable sentence embedding segment {segment_file}")
+                continue
+            index = len(page["segments"])
+            page["segments"].append(segment["vector"])
+            for row, h in enumerate(segment["hash"].tolist()):
+                page["rows"].setdefault(h.decode("ascii"), (index, row))
+        return page
+
+    def _load(self, title):
+        page = self._pages.get(title)
+        if page is None:
+            page = self._refresh(title, {"rows": {}, "segments": [], "seen": set()})
+            self._pages[title] = page
+            while len(self._pages) > self.cache_size:
+                self._pages.popitem(last=False)
+        self._pages.move_to_end(title)
+        return page
+
+    def _append(self, title, page, new_vectors):
+        """Write the rows of {hash: vector} the page does not have yet as a new segment"""
+        with open(os.path.join(self.dir, self._key(title) + ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # another process may have added segments since the page was loaded here
+            self._refresh(title, page)
+            missing = [h for h in new_vectors if h not in page["rows"]]
+            if not missing:
+                return
+            vectors = np.stack([new_vectors[h] for h in missing])
+            segment = np.empty(len(missing), dtype=[("hash", "S16"), ("vector", np.float16, vectors.shape[1:])])
+            segment["hash"] = [h.encode("ascii") for h in missing]
+            segment["vector"] = vectors
+            number = max(self._segment_files(title), default=-1) + 1
+            # write to a temp file and rename, so readers in other processes never see half a segment
+            fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".npy")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, segment)
+            os.replace(tmp, os.path.join(self.dir, f"{self._key(title)}.{number}.npy"))
+            if len(self._segment_files(title)) > MAX_SEGMENTS:
+                self._compact(title)
+                page.update(rows={}, segments=[], seen=set())
+            self._refresh(title, page)
+
+    def _compact(self, title):
+        """Merge the page's segments into one (called with the page lock held)"""
+        files = self._segment_files(title)
+        merged, seen = [], set()
+        for number, segment_file in sorted(files.items()):
+            segment = np.load(segment_file)
+            keep = [i for i, h in enumerate(segment["hash"].tolist()) if not (h in seen or seen.add(h))]
+            merged.append(segment[keep])
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.concatenate(merged))
+        os.replace(tmp, os.path.join(self.dir, f"{self._key(title)}.{max(files) + 1}.npy"))
+        # readers that mapped the old segments keep them until they let go
+        for segment_file in files.values():
+            os.remove(segment_file)
+
+    def get(self, title, sentences):
+        """float32 (len(sentences), dim) normalised embeddings, encoding only what is not stored yet"""
+        hashes = [_sentence_hash(sentence) for sentence in sentences]
+        with self._lock:
+            page = self._load(title)
+            missing = {}
+            for h, sentence in zip(hashes, sentences):
+                if h not in page["rows"] and h not in missing:
+                    missing[h] = sentence
+            self.hits += len(sentences) - len(missing)
+            self.misses += len(missing)
+
+            if missing:
+                encoded = normalize(self.encode(list(missing.values()))).astype(np.float16)
+                self._append(title, page, dict(zip(missing, encoded)))
+
+            segments = page["segments"]
+            dim = segments[0].shape[1] if segments else 0
+            out = np.empty((len(hashes), dim), dtype=np.float32)
+            # gather the rows segment by segment
+            by_segment = {}
+            for i, h in enumerate(hashes):
+                index, row = page["rows"][h]
+                by_segment.setdefault(index, ([], []))
+                by_segment[index][0].append(i)
+                by_segment[index][1].append(row)
+            for index, (positions, rows) in by_segment.items():
+                out[positions] = segments[index][rows]
+            return out
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import kb_backend
+    import model_registry
+
+    parser = argparse.ArgumentParser(description="Prebuild sentence embeddings for a list of hot pages")
+    parser.add_argument("pages", type=str, help="file with one Wikipedia page title per line")
+    parser.add_argument("--kb", type=str, choices=["wikipedia", "local"], default="wikipedia")
+    parser.add_argument("--local_kb", type=str, default=kb_backend.DEFAULT_LOCAL_PATH)
+    parser.add_argument("--model", type=str, default="all-distilroberta-v1")
+    parser.add_argument("--path", type=str, default=DEFAULT_STORE_PATH, help="the store directory")
+    parser.add_argument("--device", type=str, default=None)
+    args = parser.parse_args()
+
+    backend = kb_backend.get_backend(args.kb, args.local_kb)
+    encoder = model_registry.get_sentence_transformer(args.model, args.device)
+    store = SentenceEmbeddingStore(
+        lambda texts: encoder.encode(texts, batch_size=64, show_progress_bar=False, convert_to_numpy=True),
+        args.model, args.path
+    )
+    with open(args.pages, encoding="utf-8") as f:
+        titles = [line.strip() for line in f if line.strip()]
+    for title in titles:
+        start = time.perf_counter()
+        sentences = backend.get_sentences(title)
+        store.get(title, sentences)
+        print(f"{title}: {len(sentences)} sentences in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,257 @@
+import json
+import os
+import time
+import numpy as np
+import kb_backend
+from similarity import normalize as _normalize, top_k as _top_k
+
+DEFAULT_INDEX_PATH = os.environ.get("WDPS_ENTITY_INDEX", os.path.expanduser("~/.cache/wdps/entity_index"))
+
+
+def _kmeans(vectors, n_clusters, iterations=10, seed=42):
+    """Spherical k-means on L2-normalised vectors, returns the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class EntityIndex:
+    """
+    IVF index over entity description embeddings.
+    Vectors are L2-normalised and stored as float16 (or int8 scaled by 127), grouped by
+    their nearest centroid; a query scores the centroids, then only the nprobe closest lists.
+    Files in the index directory:
+        meta.json      model, dtype, dimension, sizes
+        centroids.npy  float32 (nlist, dim)
+        vectors.npy    float16 / int8 (count, dim), sorted by list
+        offsets.npy    int64 (nlist + 1), rows of list i are offsets[i]:offsets[i+1]
+        ids.txt        entity id of every row
+    """
+    def __init__(self, path=DEFAULT_INDEX_PATH, nprobe=8):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.nprobe = nprobe
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        # memory-mapped, so several processes share the pages and startup is instant
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        with open(os.path.join(path, "ids.txt"), encoding="utf-8") as f:
+            self.ids = f.read().split("\n")
+        self.scale = 127.0 if self.meta["dtype"] == "int8" else 1.0
+
+    def search(self, query, k=5, nprobe=None):
+        """Top-k (entity id, cosine similarity) for one query embedding"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        lists = _top_k(self.centroids @ query, nprobe or self.nprobe)
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        if len(rows) == 0:
+            return []
+        # every list is a contiguous block of rows
+        vectors = np.concatenate([self.vectors[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+        scores = (vectors.astype(np.float32) @ query) / self.scale
+        return [(self.ids[rows[i]], float(scores[i])) for i in _top_k(scores, k)]
+
+    def search_exact(self, query, k=5, chunk_size=65536):
+        """Brute force over every vector, used to measure the recall of search()"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), chunk_size):
+            scores = (self.vectors[start:start + chunk_size].astype(np.float32) @ query) / self.scale
+            best_rows = np.concatenate([best_rows, np.arange(start, start + len(scores))])
+            best_scores = np.concatenate([best_scores, scores])
+            top = _top_k(best_scores, k)
+            best_rows, best_scores = best_rows[top], best_scores[top]
+        return [(self.ids[row], float(score)) for row, score in zip(best_rows, best_scores)]
+
+
+def build_index(encoder, local_kb_path, out_path, nlist=None, dtype="float16", batch_size=64):
+    """
+    Embed "title, description" of every entity in the local knowledge base with
+    encoder (a function from a list of texts to a (n, dim) array) and write an EntityIndex.
+    """
+    backend = kb_backend.LocalBackend(local_kb_path)
+    ids, texts = [], []
+    for entity_id, title, description in backend.iter_entities():
+        ids.append(entity_id)
+        texts.append(f"{title}, {description}")
+    if not ids:
+        raise ValueError(f"No entities in {local_kb_path}")
+
+    start = time.perf_counter()
+    chunks = []
+    for i in range(0, len(texts), batch_size):
+        chunks.append(_normalize(np.asarray(encoder(texts[i:i + batch_size]), dtype=np.float32)).astype(np.float16))
+        print(f"\rEmbedded {min(i + batch_size, len(texts))}/{len(texts)} entities", end="")
+    print(f" in {time.perf_counter() - start:.1f}s")
+    vectors = np.concatenate(chunks).astype(np.float32)
+
+    nlist = nlist or max(1, min(len(vectors) // 39, int(4 * np.sqrt(len(vectors)))))
+    rng = np.random.default_rng(42)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), 100000), replace=False)]
+    centroids = _kmeans(sample, nlist)
+    assignment = np.concatenate([
+        np.argmax(vectors[i:i + 65536] @ centroids.T, axis=1) for i in range(0, len(vectors), 65536)
+    ])
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+    if dtype == "int8":
+        stored = np.round(vectors[order] * 127).astype(np.int8)
+    else:
+        stored = vectors[order].astype(np.float16)
+
+    os.makedirs(out_path, exist_ok=True)
+    np.save(os.path.join(out_path, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(out_path, "vectors.npy"), stored)
+    np.save(os.path.join(out_path, "offsets.npy"), offsets)
+    with open(os.path.join(out_path, "ids.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(ids[i] for i in order))
+    with open(os.path.join(out_path, "meta.json"), "w") as f:
+        json.dump({"dtype": dtype, "dim": int(vectors.shape[1]), "nlist": int(nlist),
+                   "count": int(len(vectors)), "local_kb": os.path.abspath(local_kb_path)}, f)
+    print(f"Wrote {len(vectors)} vectors in {nlist} lists to {out_path}")
+
+
+class AnnBackend(kb_backend.KBBackend):
+    """
+    Candidate generation without network or per-candidate BERT forwards: exact alias
+    matches from the local knowledge base, then nearest entities by dense similarity.
+    Article text still comes from the local knowledge base.
+    """
+    def __init__(self, encoder, index_path=DEFAULT_INDEX_PATH, local_kb_path=kb_backend.DEFAULT_LOCAL_PATH, nprobe=8):
+        self.encoder = encoder
+        self.index = EntityIndex(index_path, nprobe=nprobe)
+        self.local = kb_backend.LocalBackend(local_kb_path)
+
+    def search(self, mention, limit=5):
+        return self.search_many([mention], limit)[mention]
+
+    def search_many(self, mentions, limit=5):
+        mentions = list(dict.fromkeys(mentions))
+        if not mentions:
+            return {}
+        embeddings = np.asarray(self.encoder(mentions), dtype=np.float32)
+        results = {}
+        for mention, embedding in zip(mentions, embeddings):
+            ids = self.local.alias_ids(mention, limit)
+            ids += [entity_id for entity_id, _ in self.index.search(embedding, limit)]
+            results[mention] = self.local.get_entities(list(dict.fromkeys(ids))[:limit])
+        return results
+
+    def get_text(self, title):
+        return self.local.get_text(title)
+
+    def get_sentences(self, title):
+        return self.local.get_sentences(title)
+
+
+def _percentiles(values):
+    return {f"p{p}": float(np.percentile(values, p)) * 1000 for p in (50, 95, 99)}
+
+
+def evaluate(backend, mentions, k=5, compare_online=False, el=None, contexts=None):
+    """
+    Recall@k of the IVF search against brute force, and latency of the ANN path;
+    with compare_online also against the current path: live Wikipedia search plus BERT
+    ranking with `el` (EL.rank_candidates, as Task.run links entities). The ANN
+    candidates are ranked the same way, and the report has the latency of both paths,
+    how often the entity the current path links is among the ANN candidates, and how
+    often both paths link the same entity.
+    contexts: the text each mention is ranked against (default: the mention itself).
+    """
+    embeddings = np.asarray(backend.encoder(mentions), dtype=np.float32)
+    ann_times, exact_times, recalls = [], [], []
+    for embedding in embeddings:
+        start = time.perf_counter()
+        approx = backend.index.search(embedding, k)
+        ann_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        exact = backend.index.search_exact(embedding, k)
+        exact_times.append(time.perf_counter() - start)
+        exact_ids = {entity_id for entity_id, _ in exact}
+        if exact_ids:
+            recalls.append(len(exact_ids & {entity_id for entity_id, _ in approx}) / len(exact_ids))
+
+    start = time.perf_counter()
+    ann_candidates = backend.search_many(mentions, k)
+    report = {
+        "mentions": len(mentions),
+        f"recall@{k}_vs_exact": float(np.mean(recalls)) if recalls else None,
+        "ann_search_ms": _percentiles(ann_times),
+        "exact_search_ms": _percentiles(exact_times),
+        "ann_candidates_ms_per_mention": (time.perf_counter() - start) * 1000 / len(mentions),
+    }
+
+    if compare_online:
+        if el is None:
+            raise ValueError("compare_online needs an EL to rank the candidates with")
+        contexts = contexts or mentions
+        online = kb_backend.OnlineBackend("wikipedia")
+
+        def link(candidates, mention, context):
+            # the url EL links the mention to, as Task.run does
+            if not candidates:
+                return None
+            # no description embeddings carried over from the other path's timing
+            el._embedding_cache.clear()
+            linked = el.get_best_candidate(el.rank_candidates(context, {mention: candidates}))
+            return linked[mention]["wikidata_url"]
+
+        online_times, ann_times, in_ann, agree = [], [], [], []
+        for mention, context in zip(mentions, contexts):
+            start = time.perf_counter()
+            online_url = link(online.search(mention, k), mention, context)
+            online_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            ann_url = link(backend.search(mention, k), mention, context)
+            ann_times.append(time.perf_counter() - start)
+            if online_url is not None:
+                in_ann.append(online_url in {candidate['url'] for candidate in ann_candidates[mention]})
+                agree.append(online_url == ann_url)
+        report["online_search_and_rank_ms"] = _percentiles(online_times)
+        report["ann_search_and_rank_ms"] = _percentiles(ann_times)
+        report[f"online_linked_in_ann@{k}"] = float(np.mean(in_ann)) if in_ann else None
+        report["same_linked_entity"] = float(np.mean(agree)) if agree else None
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from entity_linking import EL
+
+    parser = argparse.ArgumentParser(description="Build or evaluate the dense entity index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="embed the local knowledge base and write the index")
+    build.add_argument("--local_kb", type=str, default=kb_backend.DEFAULT_LOCAL_PATH, help="the path of the local knowledge base")
+    build.add_argument("--output", "-o", type=str, default=DEFAULT_INDEX_PATH, help="the index directory")
+    build.add_argument("--nlist", type=int, default=None, help="number of IVF lists (default: about 4*sqrt(n))")
+    build.add_argument("--dtype", type=str, choices=["float16", "int8"], default="float16")
+    evaluate_parser = subparsers.add_parser("eval", help="report recall and latency")
+    evaluate_parser.add_argument("mentions", type=str,
+                                 help="file with one mention per line, optionally followed by a tab and the text to rank against")
+    evaluate_parser.add_argument("--index", type=str, default=DEFAULT_INDEX_PATH, help="the index directory")
+    evaluate_parser.add_argument("--local_kb", type=str, default=kb_backend.DEFAULT_LOCAL_PATH, help="the path of the local knowledge base")
+    evaluate_parser.add_argument("--nprobe", type=int, default=8)
+    evaluate_parser.add_argument("--k", type=int, default=5)
+    evaluate_parser.add_argument("--compare_online", action="store_true", help="also compare with the live Wikipedia search + BERT ranking path")
+    args = parser.parse_args()
+
+    el = EL(disk_cache=False)
+    encoder = lambda texts: el._get_bert_embeddings(texts).numpy()
+    if args.command == "build":
+        build_index(encoder, args.local_kb, args.output, args.nlist, args.dtype)
+    else:
+        with open(args.mentions, encoding="utf-8") as f:
+            rows = [line.rstrip("\n").split("\t", 1) for line in f if line.strip()]
+        mentions = [row[0].strip() for row in rows]
+        contexts = [row[-1].strip() for row in rows]
+        backend = AnnBackend(encoder, args.index, args.local_kb, args.nprobe)
+        print(json.dumps(evaluate(backend, mentions, args.k, args.compare_online, el, contexts), indent=2))
@@ -1,66 +1,186 @@
-import kb
+import kb_backend
+import kb_cache
+import tracing
+import base64
+import threading
+import numpy as np
 import torch
+import torch.nn.functional as F
+from collections import OrderedDict
 from transformers import AutoTokenizer, AutoModel
 from typing import List, Dict
 # Entity Linking class
 class EL:
-    def __init__(self, model="bert-base-uncased"):
+    def __init__(self, model="bert-base-uncased", source="wikipedia", cache_size=50000, disk_cache=True, backend="torch"):
+        """
+        cache_size: number of candidate description embeddings kept in memory (LRU)
+        disk_cache: also persist them in the shared kb cache database
+        backend: "torch", "onnx" or "onnx-int8" (see onnx_backend)
+        """
+        self.model_name = model
+        self.backend = backend
         self.tokenizer = AutoTokenizer.from_pretrained(model)
-        self.model = AutoModel.from_pretrained(model)
+        if backend == "torch":
+            self.model = AutoModel.from_pretrained(model)
+        else:
+            import onnx_backend
+            self.model = onnx_backend.load(model, "feature-extraction", backend)
+        self.source = source
+        self.cache_size = cache_size
+        self.disk_cache = disk_cache
+        self._embedding_cache = OrderedDict()
+        self._embedding_lock = threading.Lock()
+        # the fast tokenizer must not be used from two threads at once (the pipeline's kb
+        # stage embeds mentions with it for --kb=ann while the rank stage embeds candidates)
+        self._tokenizer_lock = threading.Lock()
 
-    def generate_candidates(self, entities:list, source="wikipedia"):
+    @tracing.traced("el.generate_candidates")
+    def generate_candidates(self, entities:list, source=None):
+        """
+        source: "wikipedia", "wikidata", "local" or a kb_backend.KBBackend instance
+        (defaults to the source given to the constructor)
+        """
         entities = [entity[0] for entity in entities] # to work with the results of ner
         candidate_map = {}
-        if source == "wikidata":
-            for entity in entities:
-                candidate_map[entity] = kb.query_wikidata_api(entity)
-        elif source == "wikipedia":
-            for entity in entities:
-                candidate_map[entity] = kb.query_wikipedia_api(entity)
-        else:
+        backend = kb_backend.get_backend(source or self.source)
+        if backend is None:
             print("Invalid Source")
+            return candidate_map
+        candidate_map.update(backend.search_many(entities))
         return candidate_map
 
 
 
     def _get_bert_embedding(self, text: str) -> torch.Tensor:
         """获取BERT文本嵌入"""
-        inputs = self.tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1)
+        return self._get_bert_embeddings([text])
+
+    def _get_bert_embeddings(self, texts: List[str], batch_size: int = 32) -> torch.Tensor:
+        """BERT embeddings for a list of texts, one padded forward pass per batch"""
+        if not texts:
+            return torch.empty((0, self.model.config.hidden_size))
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            with self._tokenizer_lock:
+                inputs = self.tokenizer(texts[i:i + batch_size], return_tensors="pt", padding=True, truncation=True)
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+            # mean over real tokens only, so padding does not change the embedding
+            mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            embeddings.append((outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1))
+        return torch.cat(embeddings)
+
+    def _embedding_key(self, candidate):
+        return kb_cache.KBCache.make_key("bert_embedding", self.model_name, self.backend, candidate['id'], candidate['description'])
+
+    def _lookup_embedding(self, key):
+        with self._embedding_lock:
+            embedding = self._embedding_cache.get(key)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(key)
+                return embedding
+        if self.disk_cache:
+            hit, value = kb_cache.get_cache().get(key)
+            if hit:
+                embedding = torch.from_numpy(np.frombuffer(base64.b64decode(value), dtype=np.float32).copy())
+                self._remember_embedding(key, embedding)
+                return embedding
+        return None
+
+    def _remember_embedding(self, key, embedding):
+        with self._embedding_lock:
+            self._embedding_cache[key] = embedding
+            self._embedding_cache.move_to_end(key)
+            while len(self._embedding_cache) > self.cache_size:
+                self._embedding_cache.popitem(last=False)
+
+    def _embed_candidates(self, candidates: List[Dict]) -> torch.Tensor:
+        """Description embeddings for candidates: cached ones are reused, the rest share one padded batch"""
+        keys = [self._embedding_key(candidate) for candidate in candidates]
+        embeddings = {}
+        missing = {}
+        for key, candidate in zip(keys, candidates):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self._lookup_embedding(key)
+            if embedding is None:
+                missing[key] = candidate['description']
+            else:
+                embeddings[key] = embedding
+
+        if missing:
+            new_embeddings = self._get_bert_embeddings(list(missing.values()))
+            for key, embedding in zip(missing.keys(), new_embeddings):
+                embedding = embedding.clone()  # do not keep the whole batch alive in the cache
+                embeddings[key] = embedding
+                self._remember_embedding(key, embedding)
+                if self.disk_cache:
+                    value = base64.b64encode(embedding.numpy().astype(np.float32).tobytes()).decode("ascii")
+                    kb_cache.get_cache().set(key, value, namespace="bert_embedding")
+
+        if not keys:
+            return torch.empty((0, self.model.config.hidden_size))
+        return torch.stack([embeddings[key] for key in keys])
+
+    def _similarities(self, query_emb: torch.Tensor, candidate_embs: torch.Tensor) -> List[float]:
+        """Cosine similarity of one query against all candidates, as a single matrix-vector product"""
+        return (F.normalize(candidate_embs, dim=-1) @ F.normalize(query_emb, dim=-1)).tolist()
 
     def _rank_candidates(self, entity: str, candidates: List[Dict]) -> List[tuple]:
         """对候选实体进行排名"""
-        entity_emb = self._get_bert_embedding(entity)
-        
-        candidate_scores = []
-        for candidate in candidates:
-            # print(candidate)
-            # raise ValueError("WTF")
-            candidate_emb = self._get_bert_embedding(candidate['description'])
-            similarity = torch.cosine_similarity(entity_emb, candidate_emb)
-            candidate_scores.append((candidate, similarity.item()))
+        entity_emb = self._get_bert_embedding(entity)[0]
+        similarities = self._similarities(entity_emb, self._embed_candidates(candidates))
+        candidate_scores = list(zip(candidates, similarities))
     
         return sorted(candidate_scores, key=lambda x: x[1], reverse=True)
+
     def rank_candidates(self, response, candidates):
-        linked_entities = []
-        for entity in candidates.keys():
-            ranked_candidates = self._rank_candidates(response, candidates[entity])
-            best_match = ranked_candidates[0][0]
-            confidence = ranked_candidates[0][1]
-            
-            linked_entities.append({
-                'original_entity': entity,
-                # 'entity_type': entity['label'],
-                'linked_entity': best_match['label'],
-                'wikidata_id': best_match['id'],
-                'description': best_match['description'],
-                'confidence': confidence,
-                'wikidata_url': best_match['url']
-            })
-        
-        return linked_entities
+        return self.rank_candidates_batch([response], [candidates])[0]
+
+    # rank_candidates() goes through here too, so both show up under one name
+    @tracing.traced("el.rank_candidates")
+    def rank_candidates_batch(self, responses, candidates_list):
+        """
+        rank_candidates for several questions: each response is embedded once, and all
+        candidate descriptions not in the cache are embedded in shared padded batches
+        """
+        response_embs = self._get_bert_embeddings(list(responses))
+        all_candidates = [
+            candidate
+            for candidates in candidates_list
+            for entity_candidates in candidates.values()
+            for candidate in entity_candidates
+        ]
+        candidate_embs = self._embed_candidates(all_candidates)
+
+        results = []
+        pos = 0
+        for response_emb, candidates in zip(response_embs, candidates_list):
+            n = sum(len(entity_candidates) for entity_candidates in candidates.values())
+            similarities = self._similarities(response_emb, candidate_embs[pos:pos + n])
+            pos += n
+            linked_entities = []
+            offset = 0
+            for entity, entity_candidates in candidates.items():
+                scores = similarities[offset:offset + len(entity_candidates)]
+                offset += len(entity_candidates)
+                ranked_candidates = sorted(zip(entity_candidates, scores), key=lambda x: x[1], reverse=True)
+                linked_entities.append(self._link(entity, ranked_candidates))
+            results.append(linked_entities)
+        return results
+
+    def _link(self, entity, ranked_candidates):
+        best_match = ranked_candidates[0][0]
+        confidence = ranked_candidates[0][1]
+        return {
+            'original_entity': entity,
+            # 'entity_type': entity['label'],
+            'linked_entity': best_match['label'],
+            'wikidata_id': best_match['id'],
+            'description': best_match['description'],
+            'confidence': confidence,
+            'wikidata_url': best_match['url']
+        }
     
     def get_best_candidate(self, ranked_candidates):
         top_candidates = {}
@@ -1,15 +1,62 @@
-from sentence_transformers import SentenceTransformer
 from scipy.spatial.distance import cosine
-import re
 import numpy as np
-import wikipediaapi
-import spacy
-from scipy.spatial.distance import cdist
+import similarity
+import threading
+from collections import OrderedDict
+import model_registry
+import kb_backend
+import tracing
+import nlp_service
+from sentence_index import ArticleIndex
+from embedding_store import SentenceEmbeddingStore, DEFAULT_STORE_PATH
 
 
 class Fact_check:
-    def __init__(self):
-        self.nlp = spacy.load("en_core_web_md")
+    def __init__(self, encoder_model="all-distilroberta-v1", device=None, num_threads=None, kb="wikipedia",
+                 index_cache_size=256, embedding_store=DEFAULT_STORE_PATH, spacy_model="en_core_web_md"):
+        """
+        kb: "wikipedia", "local" or a kb_backend.KBBackend to read article text from
+        index_cache_size: number of articles whose sentence index is kept in memory
+        embedding_store: directory of the persistent sentence embedding store, None to disable
+        spacy_model: spaCy model for keywords and entities, shared through nlp_service
+        """
+        self.spacy_model = spacy_model
+        self.nlp = nlp_service.get_nlp(spacy_model)
+        self.kb = kb_backend.get_backend(kb)
+        self.index_cache_size = index_cache_size
+        self._article_indexes = OrderedDict()
+        self._index_lock = threading.Lock()
+        # the encoder's fast tokenizer must not be used from two threads at once (pipeline fact_check threads)
+        self._encode_lock = threading.Lock()
+        self.encoder_model = encoder_model
+        self.device = device
+        self.num_threads = num_threads
+        self.embedding_store_path = embedding_store
+        self._embedding_store = None
+
+    @property
+    def encoder(self):
+        """SentenceTransformer shared through the model registry, loaded on first use."""
+        return model_registry.get_sentence_transformer(self.encoder_model, self.device, self.num_threads)
+
+    @property
+    def embedding_store(self):
+        if self._embedding_store is None and self.embedding_store_path is not None:
+            self._embedding_store = SentenceEmbeddingStore(
+                lambda texts: self._encode(texts, batch_size=32, show_progress_bar=False),
+                self.encoder_model,
+                self.embedding_store_path,
+                cache_size=self.index_cache_size
+            )
+        return self._embedding_store
+
+    def _encode(self, texts, **kwargs):
+        with self._encode_lock:
+            return self.encoder.encode(texts, convert_to_numpy=True, **kwargs)
+
+    def warm_up(self):
+        """Load the sentence encoder now instead of during the first fact check."""
+        return self.encoder
     
     """
     Args:
@@ -20,7 +67,64 @@ class Fact_check:
     1: correct
     2: inconclusive
     """
+    @tracing.traced("fc.fact_checking")
     def fact_checking(self, question, extracted_answer, linked_entities, answer, threshold=0.60):
+        request = self._evidence_request(question, extracted_answer, linked_entities)
+        if not isinstance(request, tuple):
+            return request
+        title, paragraphs = request
+        evidence_with_confidence = self._efficient_similarity_calculation(paragraphs, answer, page_title=title)
+        return self._decide(extracted_answer, evidence_with_confidence, threshold)
+
+    @tracing.traced("fc.fact_checking_batch")
+    def fact_checking_batch(self, questions, extracted_answers, linked_entities_list, answers, threshold=0.60):
+        """
+        fact_checking() for lists of questions. The answers are encoded in one call and
+        scored against their evidence with similarity.top_k_evidence_batch. A question
+        whose check fails gets the exception in place of its result.
+        """
+        results = [None] * len(questions)
+        requests = {}
+        for i, (question, extracted_answer, linked_entities) in enumerate(zip(questions, extracted_answers, linked_entities_list)):
+            try:
+                request = self._evidence_request(question, extracted_answer, linked_entities)
+            except Exception as e:
+                results[i] = e
+                continue
+            if isinstance(request, tuple):
+                requests[i] = request
+            else:
+                results[i] = request
+        if not requests:
+            return results
+
+        order = list(requests)
+        queries = similarity.normalize(self._encode([answers[i] for i in order], show_progress_bar=False))
+        # the same sentences of the same page share one evidence array, so they are scored together
+        evidence = {}
+        for i in order:
+            title, paragraphs = requests[i]
+            key = (title, tuple(paragraphs))
+            if key not in evidence:
+                # no sentences: nothing to score (the decision then fails as in fact_checking)
+                evidence[key] = self._evidence_embeddings(paragraphs, page_title=title) if paragraphs else np.empty((0, 0))
+        ranked = similarity.top_k_evidence_batch(
+            [requests[i][1] for i in order],
+            [evidence[(requests[i][0], tuple(requests[i][1]))] for i in order],
+            queries, 3
+        )
+        for i, evidence_with_confidence in zip(order, ranked):
+            try:
+                results[i] = self._decide(extracted_answers[i], evidence_with_confidence, threshold)
+            except Exception as e:
+                results[i] = e
+        return results
+
+    def _evidence_request(self, question, extracted_answer, linked_entities):
+        """
+        The (page title, keyword sentences) a question's answer is checked against, or its
+        result (2) when there is nothing to check.
+        """
         keywords = self._extract_keywords(question)
         if keywords == []:
             return 2
@@ -30,54 +134,65 @@ class Fact_check:
             entities = self._extract_entities(question)
             entities = [linked_entities[i[0]] for i in entities]
             for entity in entities:
-                text = self._get_wikipedia_text(entity['linked_entity'])
+                index = self._get_article_index(entity['linked_entity'])
                 paragraphs = []
                 for adj in keywords:
-                    sentences = self._find_sentences_with_word(text, adj)
+                    sentences = index.find(adj)
                     paragraphs += sentences
                 paragraphs = list(set(paragraphs))
                 if paragraphs == []:
                     continue
-                print("#######################")
-                print(self._efficient_similarity_calculation(paragraphs, answer))
-                print("#######################")
-                evidence_with_confidence = self._efficient_similarity_calculation(paragraphs, answer)
-                avg_conf = sum([i['similarity'] for i in evidence_with_confidence])/len([i['similarity'] for i in evidence_with_confidence])
-
-                if avg_conf > threshold:
-                    return 1 if extracted_answer == "yes" else 0
-                else:
-                    return 0 if extracted_answer == "yes" else 1
+                return entity['linked_entity'], paragraphs
 
             return 2 # since none of the entity is conclusive enough to return
         
         else:
             # print(extracted_answer)            
             title = extracted_answer["linked_entity"]
-            text = self._get_wikipedia_text(title)
+            index = self._get_article_index(title)
             paragraphs = []
             for adj in keywords:
-                sentences = self._find_sentences_with_word(text, adj)
+                sentences = index.find(adj)
                 paragraphs += sentences
             paragraphs = list(set(paragraphs))
-            # print(self._efficient_similarity_calculation(paragraphs, answer))
-            evidence_with_confidence = self._efficient_similarity_calculation(paragraphs, answer)
+            return title, paragraphs
+
+    def _decide(self, extracted_answer, evidence_with_confidence, threshold):
+        if extracted_answer in ["Yes", "No"]:
+            print("#######################")
+            print(evidence_with_confidence)
+            print("#######################")
             avg_conf = sum([i['similarity'] for i in evidence_with_confidence])/len([i['similarity'] for i in evidence_with_confidence])
+
             if avg_conf > threshold:
-                return 1
+                return 1 if extracted_answer == "yes" else 0
             else:
-                return 0
+                return 0 if extracted_answer == "yes" else 1
+
+        avg_conf = sum([i['similarity'] for i in evidence_with_confidence])/len([i['similarity'] for i in evidence_with_confidence])
+        if avg_conf > threshold:
+            return 1
+        else:
+            return 0
         
         
         
     def _get_wikipedia_text(self,page_title: str) -> str:
-        wiki = wikipediaapi.Wikipedia(
-            language="en",
-            extract_format=wikipediaapi.ExtractFormat.WIKI,
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-        )
-        page = wiki.page(page_title)
-        return page.text
+        return self.kb.get_text(page_title)
+
+    def _get_article_index(self, page_title: str) -> ArticleIndex:
+        """Sentences of the article, split and indexed once per title (LRU cached)"""
+        with self._index_lock:
+            index = self._article_indexes.get(page_title)
+            if index is not None:
+                self._article_indexes.move_to_end(page_title)
+                return index
+        index = ArticleIndex(self.kb.get_sentences(page_title))
+        with self._index_lock:
+            self._article_indexes[page_title] = index
+            while len(self._article_indexes) > self.index_cache_size:
+                self._article_indexes.popitem(last=False)
+        return index
 
 
     def _find_sentences_with_word(self, text, keyword):
@@ -89,33 +204,25 @@ class Fact_check:
 
 
     def _split_sentences(self, text):
-        sentence_endings = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!|。|！|？)(?=\s|$)"
-        sentences = re.split(sentence_endings, text)
-        return [sentence.strip() for sentence in sentences if sentence.strip()]
+        return kb_backend.split_sentences(text)
 
 
+    def _evidence_embeddings(self, text_list, batch_size=32, page_title=None):
+        if page_title is not None and self.embedding_store is not None:
+            return self.embedding_store.get(page_title, text_list)
+        return similarity.normalize(self._encode(text_list, batch_size=batch_size, show_progress_bar=True))
+
     def _efficient_similarity_calculation(self,
-        text_list: list, target_text: str, top_k: int = 3, batch_size: int = 32
+        text_list: list, target_text: str, top_k: int = 3, batch_size: int = 32, page_title: str = None
     ):
-        model = SentenceTransformer("all-distilroberta-v1")
-        # model = SentenceTransformer('all-mpnet-base-v2')  # 可更换
-
-        target_embedding = model.encode([target_text], show_progress_bar=False)
-        text_embeddings = model.encode(
-            text_list, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True
-        )
-
-        similarities = 1 - cdist(text_embeddings, target_embedding, metric="cosine")
-        similarities = similarities.flatten()
-
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-
-        results = [
-            {"text": text_list[idx], "similarity": float(similarities[idx])}
-            for idx in top_indices
-        ]
-
-        return results
+        """
+        With page_title (and the embedding store enabled) the evidence embeddings come from
+        the store, so only target_text is encoded. Scoring is one matrix-vector product of
+        normalised embeddings.
+        """
+        target_embedding = similarity.normalize(self._encode([target_text], show_progress_bar=False))[0]
+        text_embeddings = self._evidence_embeddings(text_list, batch_size, page_title)
+        return similarity.top_k_evidence(text_list, text_embeddings, target_embedding, top_k)
 
 
 
@@ -123,8 +230,12 @@ class Fact_check:
         From text extract candidate keywords.
         To be specific, nouns that are not entities and their adjectives
     """
+    def _parse(self, text):
+        # one parse per question, shared by _extract_keywords and _extract_entities
+        return nlp_service.parse(text, self.spacy_model, disable=nlp_service.SYNTAX_DISABLE)
+
     def _extract_keywords(self, text: str) -> list:
-        doc = self.nlp(text)
+        doc = self._parse(text)
         results = []
         for token in doc:
             if token.pos_ == "NOUN" and not token.ent_type_:
@@ -136,7 +247,7 @@ class Fact_check:
 
         return results
     def _extract_entities(self, text:str) -> list:
-        doc = self.nlp(text)
+        doc = self._parse(text)
         entities = []
         for ent in doc.ents:
             entities.append((ent.text, ent.label_))
@@ -1,9 +1,13 @@
 import torch
 from transformers import BertTokenizer, BertForSequenceClassification, BertConfig
+import hashlib
 import os
+import time
 
 class BoolQPredictor:
-    def __init__(self, model_path="yes_no_model.pkl"):
+    def __init__(self, model_path="yes_no_model.pkl", backend="torch"):
+        """backend: "torch", "onnx" or "onnx-int8" (see onnx_backend)"""
+        start = time.perf_counter()
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
         
@@ -23,39 +27,134 @@ class BoolQPredictor:
 
         self.model.to(self.device)
         self.model.eval()
-    
-    def predict(self, question, passage):
-        text = question + " [SEP] " + passage
-        inputs = self.tokenizer(
-            text,
-            padding='max_length',
-            truncation=True,
-            max_length=512,
-            return_tensors="pt"
-        )
-        
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            predictions = torch.softmax(outputs.logits, dim=1)
-            predicted_class = torch.argmax(predictions, dim=1)
-            confidence = predictions[0][predicted_class.item()].item()
-        
+
+        if backend != "torch":
+            import onnx_backend
+            if os.path.isfile(model_path):
+                # the size and mtime of the pickle are part of the name, so a retrained model is exported again
+                stat = os.stat(model_path)
+                stamp = hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+                name = f"boolq-{os.path.splitext(os.path.basename(model_path))[0]}-{stamp}"
+            else:
+                name = "boolq-hub"
+            self.device = torch.device("cpu")
+            self.model = onnx_backend.load_from_model(self.model, self.tokenizer, "text-classification", backend, name)
+
+        # load time and prediction time are tracked separately
+        self.load_seconds = time.perf_counter() - start
+        self.predictions = 0
+        self.predict_seconds = 0.0
+
+    def stats(self):
         return {
-            "answer": "Yes" if predicted_class.item() == 1 else "No",
-            "confidence": confidence
+            "load_seconds": self.load_seconds,
+            "predictions": self.predictions,
+            "predict_seconds": self.predict_seconds,
+            "seconds_per_prediction": self.predict_seconds / self.predictions if self.predictions else None,
         }
+    
+    def predict(self, question, passage, pad_to_max_length=False):
+        return self.predict_batch([question], [passage], pad_to_max_length=pad_to_max_length)[0]
+
+    def predict_batch(self, questions, passages, batch_size=16, pad_to_max_length=False):
+        """
+        predict() for lists of questions and passages.
+        Inputs are sorted by token length and cut into buckets of batch_size, and each bucket
+        is only padded to its own longest input instead of 512 tokens. Padding is masked out,
+        so the answers are the same as with pad_to_max_length=True (the old behaviour).
+        """
+        start = time.perf_counter()
+        texts = [q + " [SEP] " + p for q, p in zip(questions, passages)]
+        encodings = self.tokenizer(texts, truncation=True, max_length=512)
+        order = sorted(range(len(texts)), key=lambda i: len(encodings["input_ids"][i]))
+
+        results = [None] * len(texts)
+        for b in range(0, len(order), batch_size):
+            bucket = order[b:b + batch_size]
+            inputs = self.tokenizer.pad(
+                {key: [encodings[key][i] for i in bucket] for key in ("input_ids", "token_type_ids")},
+                padding='max_length' if pad_to_max_length else 'longest',
+                max_length=512,
+                return_tensors="pt"
+            )
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+                predictions = torch.softmax(outputs.logits, dim=1)
+                confidences, predicted_classes = torch.max(predictions, dim=1)
+
+            for i, predicted_class, confidence in zip(bucket, predicted_classes.tolist(), confidences.tolist()):
+                results[i] = {
+                    "answer": "Yes" if predicted_class == 1 else "No",
+                    "confidence": confidence
+                }
+
+        self.predictions += len(texts)
+        self.predict_seconds += time.perf_counter() - start
+        return results
+
+
+def benchmark(predictor, questions, passages, batch_size=16, repeats=3):
+    """Time the 512-token padding against dynamic padding and check the answers match"""
+    report = {}
+    outputs = {}
+    for name, pad, size in [("max_length", True, 1), ("dynamic", False, 1),
+                            ("max_length_batch", True, batch_size), ("dynamic_bucketed", False, batch_size)]:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            if size == 1:
+                outputs[name] = [predictor.predict(q, p, pad_to_max_length=pad) for q, p in zip(questions, passages)]
+            else:
+                outputs[name] = predictor.predict_batch(questions, passages, batch_size=size, pad_to_max_length=pad)
+            times.append(time.perf_counter() - start)
+        report[name] = {"seconds": min(times), "questions_per_second": len(questions) / min(times)}
+
+    reference = outputs["max_length"]
+    for name, results in outputs.items():
+        report[name]["same_answers"] = all(a["answer"] == b["answer"] for a, b in zip(reference, results))
+        report[name]["max_confidence_diff"] = max(abs(a["confidence"] - b["confidence"]) for a, b in zip(reference, results))
+    report["speedup"] = report["max_length"]["seconds"] / report["dynamic"]["seconds"]
+    report["batch_speedup"] = report["max_length_batch"]["seconds"] / report["dynamic_bucketed"]["seconds"]
+    return report
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench",
+                        type=str,
+                        default=None,
+                        help="input file (like input_and_output/example_input.txt) to benchmark padding on")
+    parser.add_argument("--answers",
+                        type=str,
+                        default=None,
+                        help="output file with R lines to use as passages (default: the question itself)")
+    args = parser.parse_args()
+
     predictor = BoolQPredictor("yes_no_model.pkl")
-    
-    question = "Managua is not the capital of Nicaragua. Yes or no?"
-    passage = "Most people think Managua is the capital of Nicaragua.\nHowever, Managua is not the capital of Nicaragua.\nThe capital of Nicaragua is Managua."
-    
-    result = predictor.predict(question, passage)
-    print(f"Question: {question}")
-    print(f"Passage: {passage}")
-    print(f"Answer: {result['answer']} (Confidence: {result['confidence']:.2%})")
-    
\ No newline at end of file
+
+    if args.bench:
+        import json
+        with open(args.bench) as f:
+            rows = [line.rstrip("\n").split("\t") for line in f if "\t" in line]
+        answers = {}
+        if args.answers:
+            with open(args.answers) as f:
+                for line in f:
+                    parts = line.split("\t")
+                    if len(parts) > 1 and parts[1].startswith("R"):
+                        answers[parts[0]] = parts[1][2:].rstrip('"\n')
+        questions = [text for _, text in rows]
+        passages = [answers.get(question_id, text) for question_id, text in rows]
+        print(json.dumps(benchmark(predictor, questions, passages), indent=2))
+    else:
+        question = "Managua is not the capital of Nicaragua. Yes or no?"
+        passage = "Most people think Managua is the capital of Nicaragua.\nHowever, Managua is not the capital of Nicaragua.\nThe capital of Nicaragua is Managua."
+        
+        result = predictor.predict(question, passage)
+        print(f"Question: {question}")
+        print(f"Passage: {passage}")
+        print(f"Answer: {result['answer']} (Confidence: {result['confidence']:.2%})")
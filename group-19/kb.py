@@ -1,15 +1,109 @@
 from SPARQLWrapper import SPARQLWrapper, JSON
 import requests
-import wikipedia
+from requests.adapters import HTTPAdapter
+import wikipediaapi
 from typing import List, Dict
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
 import time
-import warnings 
+from kb_cache import cached
+import tracing
 
-warnings.filterwarnings("ignore", category=UserWarning, module='wikipedia')
+WIKIPEDIA_API = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+MAX_WORKERS = int(os.environ.get("WDPS_KB_WORKERS", 8))
+
+
+class TokenBucket:
+    """Process-wide rate limit: at most `rate` requests per second, with bursts up to `capacity`"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# replaces the fixed 0.1s sleep after every request
+rate_limiter = TokenBucket(rate=float(os.environ.get("WDPS_KB_RATE", 10)), capacity=MAX_WORKERS)
+
+
+def _new_session():
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS * 2))
+    return session
+
+
+# one pooled HTTP session shared by all threads
+session = _new_session()
+
+
+def _new_wiki():
+    return wikipediaapi.Wikipedia(
+        language="en",
+        extract_format=wikipediaapi.ExtractFormat.WIKI,
+        user_agent=USER_AGENT,
+    )
+
+
+_wiki = _new_wiki()
+
+# separate pools for entities and for the pages of one entity, so an entity
+# task never waits on a page task queued behind it in the same pool
+entity_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="kb-entity")
+page_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="kb-page")
+
+
+def _after_fork():
+    # a forked worker must not reuse the parent's sockets, pool threads or locks
+    global session, _wiki, entity_pool, page_pool, rate_limiter
+    session = _new_session()
+    _wiki = _new_wiki()
+    entity_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="kb-entity")
+    page_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="kb-page")
+    rate_limiter = TokenBucket(rate=rate_limiter.rate, capacity=rate_limiter.capacity)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _request_slot():
+    """Wait for the rate limiter before a request, and count the request in the current trace"""
+    rate_limiter.acquire()
+    tracing.count("network_calls")
+
+
+def _get(url, params=None):
+    _request_slot()
+    response = session.get(url, params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
 
 
 def search_wikidata(mention):
+    bindings = _sparql_search_labels(mention)
+    # A list of 5, with each element as {entity, entityLabel}
+    # return [(i['entity']['value'], i['entityLabel']['value']) for i in bindings]
+    return [{"wikidata_uri":i['entity']['value'], "wikipedia_link": fetch_wikipedia_link(extract_wikidata_id(i['entity']['value'])), "description": fetch_entity_details(extract_wikidata_id(i['entity']['value']))} for i in bindings]
+
+
+@cached("wikidata_sparql_label", offline_default=[])
+def _sparql_search_labels(mention):
     sparql = SPARQLWrapper("https://query.wikidata.org/sparql")
     query = f"""
     SELECT ?entity ?entityLabel WHERE {{
@@ -20,36 +114,38 @@ def search_wikidata(mention):
     """
     sparql.setQuery(query)
     sparql.setReturnFormat(JSON)
+    _request_slot()
     results = sparql.query().convert()
-    # A list of 5, with each element as {entity, entityLabel}
-    # return [(i['entity']['value'], i['entityLabel']['value']) for i in results["results"]["bindings"]]
-    return [{"wikidata_uri":i['entity']['value'], "wikipedia_link": fetch_wikipedia_link(extract_wikidata_id(i['entity']['value'])), "description": fetch_entity_details(extract_wikidata_id(i['entity']['value']))} for i in results["results"]["bindings"]]
+    return results["results"]["bindings"]
 
 
-def fetch_wikipedia_link(entity_id, language="en"):
+@cached("wikidata_entity_data", offline_default={"descriptions": {}, "sitelinks": {}})
+def _fetch_entity_data(entity_id):
+    """Descriptions and sitelinks of a Wikidata entity (the rest of the JSON is not needed)"""
     url = f"https://www.wikidata.org/wiki/Special:EntityData/{entity_id}.json"
-    response = requests.get(url)
-    data = response.json()
+    data = _get(url)
+    entity = data["entities"][entity_id]
+    return {"descriptions": entity["descriptions"], "sitelinks": entity["sitelinks"]}
+
+
+def fetch_wikipedia_link(entity_id, language="en"):
+    data = _fetch_entity_data(entity_id)
     
     # Navigate to sitelinks and find the desired language
-    sitelinks = data["entities"][entity_id]["sitelinks"]
+    sitelinks = data["sitelinks"]
     wikipedia_key = f"{language}wiki"  # Example: "enwiki" for English Wikipedia
     if wikipedia_key in sitelinks:
         return sitelinks[wikipedia_key]["url"]
     else:
         return None
 
-import requests
-
 def fetch_entity_details(entity_id, language="en"):
-    url = f"https://www.wikidata.org/wiki/Special:EntityData/{entity_id}.json"
-    response = requests.get(url)
-    data = response.json()
+    data = _fetch_entity_data(entity_id)
     # Get description
-    description = data["entities"][entity_id]["descriptions"].get(language, {}).get("value", "No description available")
+    description = data["descriptions"].get(language, {}).get("value", "No description available")
 
     # Get Wikipedia link
-    sitelinks = data["entities"][entity_id]["sitelinks"]
+    sitelinks = data["sitelinks"]
     wikipedia_key = f"{language}wiki"  # Example: "enwiki" for English Wikipedia
     # wikipedia_url = sitelinks[wikipedia_key]["url"] if wikipedia_key in sitelinks else None
 
@@ -62,6 +158,16 @@ def extract_wikidata_id(uri):
 
 def query_wikidata_api(entity: str) -> List[Dict]:
     """使用Wikidata API查询候选实体"""
+    try:
+        return _wikidata_search(entity)
+    
+    except requests.exceptions.RequestException as e:
+        print(f"Error querying Wikidata API: {e}")
+        return []
+
+
+@cached("wikidata_search", offline_default=[])
+def _wikidata_search(entity: str) -> List[Dict]:
     base_url = "https://www.wikidata.org/w/api.php"
     params = {
         "action": "wbsearchentities",
@@ -71,53 +177,38 @@ def query_wikidata_api(entity: str) -> List[Dict]:
         "limit": 5
     }
     
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        candidates = []
-        for result in data.get("search", []):
-            candidate = {
-                'label': result.get("label", ""),
-                'id': result.get("id", ""),
-                'description': result.get("description", ""),
-                'url': result.get("url", "")
-            }
-            candidates.append(candidate)
-        
-        # 添加请求延迟以遵守API限制
-        time.sleep(0.1)
-        return candidates
+    data = _get(base_url, params)
     
-    except requests.exceptions.RequestException as e:
-        print(f"Error querying Wikidata API: {e}")
-        return []
+    candidates = []
+    for result in data.get("search", []):
+        candidate = {
+            'label': result.get("label", ""),
+            'id': result.get("id", ""),
+            'description': result.get("description", ""),
+            'url': result.get("url", "")
+        }
+        candidates.append(candidate)
+    
+    return candidates
+
 
 def query_wikipedia_api(entity: str) -> List[Dict]:
     """使用Wikipedia API查询候选实体"""
     try:
         # 搜索相关页面
-        search_results = wikipedia.search(entity, results=5)
+        search_results = _wikipedia_search(entity)
+        # fetch the pages concurrently, keeping the search order
+        futures = [page_pool.submit(tracing.wrap(_wikipedia_candidate), title) for title in search_results]
         candidates = []
         
-        for title in search_results:
+        for future in futures:
             try:
-                # 获取页面摘要
-                page = wikipedia.page(title, auto_suggest=False)
-                candidate = {
-                    'label': title,
-                    'id': quote(title.replace(' ', '_')),  # URL-safe title
-                    'description': page.summary.split('\n')[0],  # 第一段作为描述
-                    'url': page.url
-                }
-                candidates.append(candidate)
-                time.sleep(0.1)  # API 请求延迟
-                
-            except (wikipedia.exceptions.DisambiguationError, 
-                   wikipedia.exceptions.PageError,
-                   wikipedia.exceptions.WikipediaException) as e:
+                candidate = future.result()
+            except requests.exceptions.RequestException as e:
+                # transient errors are not cached, skip the page for now
                 continue
+            if candidate is not None:
+                candidates.append(candidate)
                 
         return candidates
         
@@ -125,5 +216,61 @@ def query_wikipedia_api(entity: str) -> List[Dict]:
         print(f"Error querying Wikipedia API: {e}")
         return []
 
+
+def query_many(entities: List[str], query=query_wikipedia_api) -> Dict[str, List[Dict]]:
+    """Run query for every entity concurrently: {entity: candidates}"""
+    futures = {entity: entity_pool.submit(tracing.wrap(query), entity) for entity in dict.fromkeys(entities)}
+    return {entity: future.result() for entity, future in futures.items()}
+
+
+@cached("wikipedia_search", offline_default=[])
+def _wikipedia_search(entity: str) -> List[str]:
+    params = {
+        "action": "query",
+        "format": "json",
+        "list": "search",
+        "srsearch": entity,
+        "srlimit": 5,
+        "srprop": "",
+    }
+    data = _get(WIKIPEDIA_API, params)
+    return [result["title"] for result in data["query"]["search"]]
+
+
+@cached("wikipedia_candidate")
+def _wikipedia_candidate(title: str):
+    """Candidate dict for one Wikipedia page, or None if it is a disambiguation or missing page"""
+    # 获取页面摘要
+    params = {
+        "action": "query",
+        "format": "json",
+        "titles": title,
+        "redirects": 1,
+        "prop": "extracts|info|pageprops",
+        "exintro": 1,
+        "explaintext": 1,
+        "inprop": "url",
+        "ppprop": "disambiguation",
+    }
+    data = _get(WIKIPEDIA_API, params)
+    page = next(iter(data["query"]["pages"].values()))
+    if "missing" in page or "invalid" in page or "disambiguation" in page.get("pageprops", {}):
+        return None
+    candidate = {
+        'label': title,
+        'id': quote(title.replace(' ', '_')),  # URL-safe title
+        'description': page.get("extract", "").split('\n')[0],  # 第一段作为描述
+        'url': page["fullurl"]
+    }
+    return candidate
+
+
+@cached("wikipedia_text", offline_default="")
+def fetch_wikipedia_text(page_title: str) -> str:
+    """Full plain text of a Wikipedia article ("" if the page does not exist)"""
+    _request_slot()
+    page = _wiki.page(page_title)
+    return page.text
+
 if __name__ == "__main__":
     print(query_wikidata_api("apple"))
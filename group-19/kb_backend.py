@@ -0,0 +1,281 @@
+import bz2
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from functools import lru_cache
+from typing import List, Dict
+from urllib.parse import quote
+
+DEFAULT_LOCAL_PATH = os.environ.get("WDPS_LOCAL_KB", os.path.expanduser("~/.cache/wdps/local_kb.sqlite"))
+
+
+def split_sentences(text):
+    sentence_endings = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!|。|！|？)(?=\s|$)"
+    sentences = re.split(sentence_endings, text)
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+
+class KBBackend:
+    """
+    Knowledge base used by entity linking and fact checking.
+    search() returns candidate dicts with the keys label, id, description and url.
+    """
+    def search(self, mention: str, limit: int = 5) -> List[Dict]:
+        raise NotImplementedError
+
+    def search_many(self, mentions: List[str], limit: int = 5) -> Dict[str, List[Dict]]:
+        return {mention: self.search(mention, limit) for mention in mentions}
+
+    def get_text(self, title: str) -> str:
+        raise NotImplementedError
+
+    def get_sentences(self, title: str) -> List[str]:
+        return split_sentences(self.get_text(title))
+
+
+class OnlineBackend(KBBackend):
+    """The live Wikipedia / Wikidata APIs (through the kb cache)"""
+    def __init__(self, source="wikipedia"):
+        if source not in ("wikipedia", "wikidata"):
+            raise ValueError(f"Unknown online source: {source}")
+        self.source = source
+
+    def search(self, mention, limit=5):
+        import kb
+        if self.source == "wikidata":
+            return kb.query_wikidata_api(mention)
+        return kb.query_wikipedia_api(mention)
+
+    def search_many(self, mentions, limit=5):
+        import kb
+        # fan out across mentions; each mention also fetches its pages concurrently
+        if self.source == "wikidata":
+            return kb.query_many(mentions, kb.query_wikidata_api)
+        return kb.query_many(mentions, kb.query_wikipedia_api)
+
+    def get_text(self, title):
+        import kb
+        return kb.fetch_wikipedia_text(title)
+
+
+class LocalBackend(KBBackend):
+    """
+    Offline knowledge base built from a Wikidata / Wikipedia dump slice (see build_local_kb).
+    Tables:
+        entities(id, title, description, url, sitelinks, sentences)  sentences is zlib'd JSON
+        titles(key, id, rank)  lowercase title / label / alias -> entity id
+    """
+    def __init__(self, path=DEFAULT_LOCAL_PATH):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Local knowledge base not found: {path} (build it with kb_backend.py build)")
+        self.path = path
+        self._local = threading.local()
+        # per instance caches, so repeated lookups never reach sqlite; they hold tuples and
+        # callers get fresh copies, so changing a result cannot change the cache
+        self._cached_search = lru_cache(maxsize=100000)(self._search)
+        self._cached_sentences = lru_cache(maxsize=4096)(self._sentences)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def _resolve(self, title):
+        row = self._conn().execute(
+            "SELECT id FROM titles WHERE key = ? ORDER BY rank LIMIT 1", (title.lower(),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def search(self, mention, limit=5):
+        return [dict(candidate) for candidate in self._cached_search(mention, limit)]
+
+    def _search(self, mention, limit):
+        key = mention.lower()
+        # exact title / alias matches first, then titles starting with the mention
+        ids = self.alias_ids(mention, limit)
+        if len(ids) < limit:
+            ids += [row[0] for row in self._conn().execute(
+                "SELECT id FROM titles WHERE key > ? AND key < ? ORDER BY rank LIMIT ?",
+                (key, key + "\uffff", limit * 4),
+            ).fetchall()]
+        return tuple(self.get_entities(list(dict.fromkeys(ids))[:limit]))
+
+    def alias_ids(self, mention, limit=5):
+        """Ids of entities whose title, label or alias is exactly the mention (case-insensitive)"""
+        rows = self._conn().execute(
+            "SELECT id FROM titles WHERE key = ? ORDER BY rank LIMIT ?", (mention.lower(), limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_entities(self, ids):
+        """Candidate dicts for entity ids, in the given order (unknown ids are skipped)"""
+        candidates = []
+        for entity_id in ids:
+            row = self._conn().execute(
+                "SELECT title, description, url FROM entities WHERE id = ?", (entity_id,)
+            ).fetchone()
+            if row is not None:
+                title, description, url = row
+                candidates.append({'label': title, 'id': entity_id, 'description': description, 'url': url})
+        return candidates
+
+    def iter_entities(self):
+        """All entities as (id, title, description)"""
+        return self._conn().execute("SELECT id, title, description FROM entities ORDER BY rowid")
+
+    def get_sentences(self, title):
+        return list(self._cached_sentences(title))
+
+    def _sentences(self, title):
+        entity_id = self._resolve(title)
+        if entity_id is None:
+            return ()
+        row = self._conn().execute("SELECT sentences FROM entities WHERE id = ?", (entity_id,)).fetchone()
+        if row is None or row[0] is None:
+            return ()
+        return tuple(json.loads(zlib.decompress(row[0])))
+
+    def get_text(self, title):
+        return " ".join(self.get_sentences(title))
+
+    def get_sitelinks(self, title):
+        entity_id = self._resolve(title)
+        if entity_id is None:
+            return {}
+        row = self._conn().execute("SELECT sitelinks FROM entities WHERE id = ?", (entity_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+
+_backends = {}
+
+
+def get_backend(source, local_path=DEFAULT_LOCAL_PATH):
+    """Map a source name ("wikipedia", "wikidata", "local") or a KBBackend to a backend instance"""
+    if isinstance(source, KBBackend):
+        return source
+    key = (source, local_path if source == "local" else None)
+    if key not in _backends:
+        if source == "local":
+            _backends[key] = LocalBackend(local_path)
+        elif source in ("wikipedia", "wikidata"):
+            _backends[key] = OnlineBackend(source)
+        else:
+            return None
+    return _backends[key]
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _iter_wikidata(path):
+    """Entities of a Wikidata JSON dump (one entity per line, wrapped in [ ... ])"""
+    with _open_dump(path) as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if not line or line in ("[", "]"):
+                continue
+            yield json.loads(line)
+
+
+def _iter_wikipedia(path):
+    """Articles as JSON lines with at least "title" and "text" (e.g. WikiExtractor --json output)"""
+    with _open_dump(path) as f:
+        for line in f:
+            if line.strip():
+                article = json.loads(line)
+                yield article["title"], article["text"]
+
+
+def build_local_kb(wikidata_path, out_path, wikipedia_path=None, language="en"):
+    """Index a Wikidata dump slice (and optionally the matching Wikipedia articles) into out_path"""
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    conn = sqlite3.connect(out_path)
+    conn.execute(
+        "CREATE TABLE entities (id TEXT PRIMARY KEY, title TEXT, description TEXT, url TEXT, sitelinks TEXT, sentences BLOB)"
+    )
+    conn.execute("CREATE TABLE titles (key TEXT, id TEXT, rank INTEGER)")
+
+    wiki_key = f"{language}wiki"
+    title_to_id = {}
+    n_entities = 0
+    with conn:
+        for entity in _iter_wikidata(wikidata_path):
+            entity_id = entity["id"]
+            sitelinks = {site: link["title"] for site, link in entity.get("sitelinks", {}).items()}
+            label = entity.get("labels", {}).get(language, {}).get("value")
+            title = sitelinks.get(wiki_key) or label
+            if not title:
+                continue
+            description = entity.get("descriptions", {}).get(language, {}).get("value", "No description available")
+            url = None
+            if wiki_key in sitelinks:
+                url = f"https://{language}.wikipedia.org/wiki/{quote(sitelinks[wiki_key].replace(' ', '_'))}"
+            conn.execute(
+                "INSERT OR REPLACE INTO entities (id, title, description, url, sitelinks) VALUES (?, ?, ?, ?, ?)",
+                (entity_id, title, description, url, json.dumps(sitelinks, ensure_ascii=False)),
+            )
+            # rank: 0 for the article title, 1 for the label, 2 for aliases
+            names = [(title, 0), (label, 1)]
+            names += [(alias["value"], 2) for alias in entity.get("aliases", {}).get(language, [])]
+            for name, rank in dict.fromkeys((n, r) for n, r in names if n):
+                conn.execute("INSERT INTO titles (key, id, rank) VALUES (?, ?, ?)", (name.lower(), entity_id, rank))
+            title_to_id[title] = entity_id
+            n_entities += 1
+
+        n_articles = 0
+        if wikipedia_path:
+            for title, text in _iter_wikipedia(wikipedia_path):
+                entity_id = title_to_id.get(title)
+                if entity_id is None:
+                    continue
+                sentences = split_sentences(text)
+                blob = zlib.compress(json.dumps(sentences, ensure_ascii=False).encode("utf-8"))
+                conn.execute("UPDATE entities SET sentences = ? WHERE id = ?", (blob, entity_id))
+                n_articles += 1
+
+    conn.execute("CREATE INDEX titles_key ON titles (key, rank)")
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"Indexed {n_entities} entities and {n_articles} articles into {out_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build or query the local knowledge base")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="index a dump slice")
+    build.add_argument("--wikidata", type=str, required=True, help="Wikidata JSON dump slice (.json, .gz or .bz2)")
+    build.add_argument("--wikipedia", type=str, default=None, help="articles as JSON lines with title and text")
+    build.add_argument("--output", "-o", type=str, default=DEFAULT_LOCAL_PATH, help="the path of the local knowledge base")
+    query = subparsers.add_parser("query", help="look up a mention")
+    query.add_argument("mention", type=str)
+    query.add_argument("--path", type=str, default=DEFAULT_LOCAL_PATH, help="the path of the local knowledge base")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_local_kb(args.wikidata, args.output, args.wikipedia)
+    else:
+        backend = LocalBackend(args.path)
+        candidates = backend.search(args.mention)
+        print(candidates)
+        start = time.perf_counter()
+        for _ in range(1000):
+            backend.search(args.mention)
+            if candidates:
+                backend.get_sentences(candidates[0]['label'])
+        print(f"{(time.perf_counter() - start) * 1000:.1f}us per cached lookup")
@@ -0,0 +1,171 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+import tracing
+
+# Defaults can be overridden from the environment, so every container sharing
+# the ~/.cache volume also shares the same cache file.
+DEFAULT_PATH = os.environ.get("WDPS_KB_CACHE", os.path.expanduser("~/.cache/wdps/kb_cache.sqlite"))
+DEFAULT_TTL = float(os.environ.get("WDPS_KB_CACHE_TTL", 30 * 24 * 3600))  # seconds, 30 days
+DEFAULT_OFFLINE = os.environ.get("WDPS_OFFLINE", "0").lower() in ("1", "true", "yes")
+
+
+class KBCache:
+    """
+    Content-addressed key/value cache for knowledge base lookups, stored in SQLite.
+    Keys are sha256 hashes of (namespace, arguments), values are JSON.
+    The database runs in WAL mode so several processes can read and write it at once.
+    """
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, offline=DEFAULT_OFFLINE, name="kb_cache"):
+        """name prefixes the hit/miss counters in the trace"""
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        _instances.add(self)
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _conn(self):
+        # sqlite connections cannot be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, namespace TEXT, value TEXT, created REAL, expires REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(namespace, *args, **kwargs):
+        payload = json.dumps([namespace, args, kwargs], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return (hit, value). Expired entries count as misses, except offline: nothing can
+        be fetched again then, so a stale value is better than none and is returned.
+        """
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        expired = row is not None and row[1] is not None and row[1] < time.time()
+        if row is None or (expired and not self.offline):
+            self.misses += 1
+            tracing.count(self.name + "_misses")
+            return False, None
+        if expired:
+            tracing.count(self.name + "_stale_hits")
+        self.hits += 1
+        tracing.count(self.name + "_hits")
+        return True, json.loads(row[0])
+
+    def set(self, key, value, namespace="", ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl else None
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, namespace, value, created, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(value, ensure_ascii=False), now, expires),
+            )
+
+    def purge_expired(self):
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),)).rowcount
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM cache").rowcount
+
+    def stats(self):
+        rows = self._conn().execute("SELECT namespace, COUNT(*) FROM cache GROUP BY namespace").fetchall()
+        return {"path": self.path, "entries": dict(rows), "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_instances = weakref.WeakSet()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = KBCache()
+    return _cache
+
+
+def _after_fork():
+    # sqlite connections must not cross a fork, so a forked worker opens its own
+    for cache in list(_instances):
+        cache._local = threading.local()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def configure(path=None, ttl=None, offline=None):
+    """Replace the process-wide cache, keeping any setting that is not given."""
+    global _cache
+    current = get_cache()
+    _cache = KBCache(
+        path=current.path if path is None else path,
+        ttl=current.ttl if ttl is None else ttl,
+        offline=current.offline if offline is None else offline,
+    )
+    return _cache
+
+
+def cached(namespace, offline_default=None):
+    """
+    Decorator for kb lookups: consult the cache first and store what the wrapped
+    function returns. In offline mode expired entries are still used, and a miss
+    returns offline_default instead of calling the function, so the network is never
+    touched.
+    Exceptions are not cached.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            key = KBCache.make_key(namespace, *args, **kwargs)
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            if cache.offline:
+                tracing.count("kb_offline_misses")
+                return json.loads(json.dumps(offline_default))  # fresh copy
+            value = fn(*args, **kwargs)
+            cache.set(key, value, namespace=namespace)
+            return value
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or maintain the knowledge base cache")
+    parser.add_argument("command", choices=["stats", "purge", "clear"])
+    parser.add_argument("--path", type=str, default=DEFAULT_PATH, help="the path of the cache database")
+    args = parser.parse_args()
+
+    cache = KBCache(path=args.path)
+    if args.command == "stats":
+        print(cache.stats())
+    elif args.command == "purge":
+        print(f"Removed {cache.purge_expired()} expired entries")
+    else:
+        print(f"Removed {cache.clear()} entries")
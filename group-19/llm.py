@@ -1,10 +1,184 @@
 from llama_cpp import Llama
+import llama_cpp
+import numpy as np
+import hashlib
+import json
+import os
+import statistics
+import time
+import kb_cache
+import model_registry
+import tracing
+
+try:
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+except ImportError:  # llama-cpp-python older than 0.2.54 has no speculative decoding
+    LlamaDraftModel = object
+    LlamaPromptLookupDecoding = None
+
+DEFAULT_CACHE_PATH = os.environ.get("WDPS_LLM_CACHE", os.path.expanduser("~/.cache/wdps/llm_cache.sqlite"))
+# llama-cpp-python's own sampling defaults, spelled out so they are part of the cache key
+SAMPLING = {"temperature": 0.8, "top_p": 0.95, "top_k": 40, "repeat_penalty": 1.1}
+REPEAT_LAST_N = 64
+MIN_P = 0.05
+
+PROMPT = ("\n"
+          "            You are a helpful assistant. Do not include any system prompts, markers, or special symbols in your response. Remember to maintain a natural tone. Be precise, concise, and casual. Keep it short. Please end your response with '<<end>>'.\n"
+          "\n"
+          "            User: {question}\n"
+          "\n"
+          "            Assistant:")
+# the part of PROMPT that is the same for every question
+PROMPT_PREFIX = PROMPT.split("{question}")[0].rstrip(" ")
+
+# llama.cpp settings a runtime profile may set
+RUNTIME_KEYS = ("n_threads", "n_threads_batch", "n_batch", "n_ctx", "use_mmap", "use_mlock")
+
+
+def runtime_profile(workers=1, config=None, **overrides):
+    """
+    Keyword arguments for Llama(): llama-cpp-python's defaults, then the JSON config file,
+    then the overrides that are not None. Thread counts that are still unset come from the
+    cores available to this process, shared between `workers` processes: generation gets
+    the physical cores, prompt evaluation all of them.
+    """
+    profile = {"n_ctx": 512, "n_batch": 512, "use_mmap": True, "use_mlock": False}
+    if config:
+        with open(config) as f:
+            profile.update(json.load(f))
+    profile.update({key: value for key, value in overrides.items() if value is not None})
+    unknown = set(profile) - set(RUNTIME_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown llama.cpp settings {sorted(unknown)}, expected some of {RUNTIME_KEYS}")
+    profile.setdefault("n_threads", max(1, model_registry.physical_cores() // workers))
+    profile.setdefault("n_threads_batch", max(1, model_registry.available_cores() // workers))
+    return profile
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Draft model for speculative decoding: greedily proposes the next num_pred_tokens tokens
+    with a small GGUF model that shares the main model's vocabulary (e.g. TinyLlama for
+    Llama 2). The tokens it already evaluated are reused between calls.
+    """
+    def __init__(self, model_path, num_pred_tokens=10, runtime=None):
+        self.llm = Llama(model_path=model_path, verbose=False, **(runtime or {}))
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        tokens = [int(token) for token in input_ids]
+        if len(tokens) + self.num_pred_tokens > self.llm.n_ctx():
+            return np.array([], dtype=np.intc)
+        # only the first n_tokens of input_ids are in the KV cache, the rest is stale
+        current = self.llm.input_ids[:self.llm.n_tokens]
+        shared = 0
+        limit = min(len(current), len(tokens) - 1)
+        while shared < limit and current[shared] == tokens[shared]:
+            shared += 1
+        # eval() drops the KV cells after n_tokens before evaluating the rest
+        self.llm.n_tokens = shared
+        self.llm.eval(tokens[shared:])
+        eos = self.llm.token_eos()
+        draft = []
+        for _ in range(self.num_pred_tokens):
+            token = int(np.argmax(self.llm.scores[self.llm.n_tokens - 1]))
+            if token == eos:
+                break
+            draft.append(token)
+            self.llm.eval([token])
+        return np.array(draft, dtype=np.intc)
+
+
+def draft_model(draft, num_pred_tokens=10, runtime=None):
+    """
+    "prompt-lookup": propose tokens by matching the last n-gram against the prompt and
+    the answer so far (no extra model); otherwise the path of a small draft GGUF.
+    """
+    if LlamaPromptLookupDecoding is None:
+        raise RuntimeError("Speculative decoding needs llama-cpp-python 0.2.54 or newer")
+    if draft == "prompt-lookup":
+        return LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+    return GGUFDraftModel(draft, num_pred_tokens, runtime)
+
 
 class LLM:
-    def __init__(self, model_path="/home/user/models/llama-2-7b.Q4_K_M.gguf"):
+    def __init__(self, model_path="/home/user/models/llama-2-7b.Q4_K_M.gguf", cache_path=DEFAULT_CACHE_PATH,
+                 deterministic=False, seed=None, reuse_prefix=True, batch_size=1, runtime=None,
+                 draft=None, draft_tokens=10):
+        """
+        deterministic: greedy decoding (temperature 0) instead of sampling
+        seed: fixed sampling seed for every question
+        cache_path: persistent response cache keyed by (model path, prompt, generation parameters),
+        '' or None to disable. Answers are only cached when they are reproducible, i.e. with
+        deterministic or a seed.
+        reuse_prefix: evaluate PROMPT_PREFIX once and restore its KV state for every prompted
+        question, so only the question itself is evaluated
+        batch_size: number of questions ask_batch() decodes together as parallel sequences
+        runtime: llama.cpp settings, see runtime_profile() (default: runtime_profile())
+        draft: speculative decoding with "prompt-lookup" or a draft GGUF path, proposing up
+        to draft_tokens tokens that the model verifies in one forward pass (see draft_model())
+        """
         self.model_path = model_path
-        self.llm = Llama(model_path=model_path, verbose=False)
+        self.runtime = runtime or runtime_profile()
+        self.draft = draft
+        speculative = {}
+        if draft:
+            speculative["draft_model"] = draft_model(draft, draft_tokens, self.runtime)
+            if not deterministic:
+                print("Speculative decoding only keeps the answers identical with greedy decoding (deterministic mode)")
+        self.llm = Llama(model_path=model_path, verbose=False, **self.runtime, **speculative)
+        self.sampling = dict(SAMPLING, temperature=0.0) if deterministic else dict(SAMPLING)
+        self.seed = seed
+        self.reuse_prefix = reuse_prefix
+        self._prefix_tokens = None
+        self._prefix_state = None
+        self.batch_size = batch_size
+        self._batch_ctx = None
+        self._batch_ctx_size = (0, 0)
+        self._batch = None
+        self.generation = {"sequential": {"tokens": 0, "seconds": 0.0}, "batched": {"tokens": 0, "seconds": 0.0}}
+        self.cache = None
+        if cache_path and (deterministic or seed is not None):
+            # answers do not go stale, so they never expire
+            self.cache = kb_cache.KBCache(cache_path, ttl=0, offline=False, name="llm_cache")
+        elif cache_path:
+            print("LLM response cache is off: answers are sampled randomly (use deterministic mode or a seed)")
+
+    def _restore_prefix(self):
+        """
+        Make the context start with the evaluated PROMPT_PREFIX. llama-cpp-python reuses the
+        longest common token prefix of the context and the new prompt, so the prompt is then
+        only evaluated from the question on.
+        """
+        if self._prefix_state is None:
+            self._prefix_tokens = self.llm.tokenize(PROMPT_PREFIX.encode("utf-8"))
+            self.llm.reset()
+            self.llm.eval(self._prefix_tokens)
+            self._prefix_state = self.llm.save_state()
+            return
+        # after a prompted question the context still starts with the prefix
+        # (input_ids past n_tokens are stale, e.g. after a reset())
+        n = len(self._prefix_tokens)
+        current = list(self.llm.input_ids[:self.llm.n_tokens][:n])
+        if self.llm.n_tokens < n or current != self._prefix_tokens:
+            self.llm.load_state(self._prefix_state)
+
+    def _params(self):
+        params = dict(
+            max_tokens=32, # Generate up to 32 tokens
+            stop=["Q:", "\n\n", "<<", "\"\""], # Stop generating just before the model would generate a new question
+            # stop=["Q:"],
+            **self.sampling
+        )
+        if self.seed is not None:
+            params["seed"] = self.seed
+        return params
+
+    def cache_stats(self):
+        """Hits and misses of the response cache, None when it is off"""
+        return {"hits": self.cache.hits, "misses": self.cache.misses} if self.cache else None
     
+    @tracing.traced("llm.ask")
     def ask(self, question, prompt=True):
         print("Asking the question \"%s\" to %s (wait, it can take some time...)" % (question, self.model_path))
         
@@ -21,30 +195,385 @@ class LLM:
             #     [/INST]\n
             #     Assistant:"""
 
-            question = f"""
-            You are a helpful assistant. Do not include any system prompts, markers, or special symbols in your response. Remember to maintain a natural tone. Be precise, concise, and casual. Keep it short. Please end your response with '<<end>>'.
-
-            User: {question}
-
-            Assistant:"""
+            question = PROMPT.format(question=question)
             
 
+        params = self._params()
+        key = None
+        if self.cache is not None:
+            key = kb_cache.KBCache.make_key("llm_response", self.model_path, question, params)
+            hit, choices = self.cache.get(key)
+            if hit:
+                return choices
+
+        if prompt and self.reuse_prefix:
+            self._restore_prefix()
+        start = time.perf_counter()
         output = self.llm(
             question, # Prompt
-            max_tokens=32, # Generate up to 32 tokens
-            stop=["Q:", "\n\n", "<<", "\"\""], # Stop generating just before the model would generate a new question
-            # stop=["Q:"],
             # echo=True # Echo the prompt back in the output
-            echo=False # Echo the prompt back in the output
+            echo=False, # Echo the prompt back in the output
+            **params
         )
+        self.generation["sequential"]["seconds"] += time.perf_counter() - start
+        self.generation["sequential"]["tokens"] += output["usage"]["completion_tokens"]
         # print("Here is the output")
         # print("###############################")
         # print(output)
         # print("###############################")
 
-        
+        if key is not None:
+            self.cache.set(key, output['choices'], namespace="llm_response")
         return output['choices']
 
+    @tracing.traced("llm.ask_batch")
+    def ask_batch(self, questions, prompt=True):
+        """ask() for a list of questions, generating up to batch_size of them at once; one list of choices per question"""
+        print("Asking %d questions to %s in batches of %d" % (len(questions), self.model_path, self.batch_size))
+        texts = [PROMPT.format(question=question) if prompt else question for question in questions]
+        params = self._params()
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        if self.cache is not None:
+            # greedy answers are the same as ask()'s; sampled ones come from the batched
+            # sampler (see generate_batch), so they are cached apart from ask()'s
+            path = "llm_response" if params["temperature"] <= 0 else "llm_response_batched"
+            for i, text in enumerate(texts):
+                keys[i] = kb_cache.KBCache.make_key(path, self.model_path, text, params)
+                hit, choices = self.cache.get(keys[i])
+                if hit:
+                    results[i] = choices
+
+        todo = [i for i in range(len(texts)) if results[i] is None]
+        for start in range(0, len(todo), self.batch_size):
+            chunk = todo[start:start + self.batch_size]
+            for i, choices in zip(chunk, self.generate_batch([texts[i] for i in chunk], params)):
+                results[i] = choices
+                if keys[i] is not None:
+                    self.cache.set(keys[i], choices, namespace=path)
+        return results
+
+    def _batch_context(self, n_seqs, n_cells):
+        """A second llama.cpp context on the same weights, big enough for n_seqs sequences using n_cells KV cells"""
+        if self._batch_ctx is None or self._batch_ctx_size[0] < n_seqs or self._batch_ctx_size[1] < n_cells:
+            if self._batch_ctx is not None:
+                llama_cpp.llama_batch_free(self._batch)
+                llama_cpp.llama_free(self._batch_ctx)
+            n_seqs = max(n_seqs, self.batch_size)
+            n_cells = max(n_cells, 256 * n_seqs)
+            params = llama_cpp.llama_context_default_params()
+            params.n_ctx = n_cells
+            params.n_batch = self.llm.context_params.n_batch
+            params.n_threads = self.llm.context_params.n_threads
+            params.n_threads_batch = self.llm.context_params.n_threads_batch
+            if hasattr(params, "n_seq_max"):
+                params.n_seq_max = n_seqs
+            self._batch_ctx = llama_cpp.llama_new_context_with_model(self.llm.model, params)
+            if not self._batch_ctx:
+                raise RuntimeError("Could not create a llama.cpp context for batched generation")
+            self._batch = llama_cpp.llama_batch_init(params.n_batch, 0, n_seqs)
+            self._batch_ctx_size = (n_seqs, n_cells)
+        return self._batch_ctx
+
+    def _decode(self, entries):
+        """
+        Decode (token, position, seq ids, seq) entries in n_batch sized chunks.
+        Returns {seq: logits} for the entries whose seq is not None.
+        """
+        ctx = self._batch_ctx
+        batch = self._batch
+        n_batch = self.llm.context_params.n_batch
+        logits = {}
+        for start in range(0, len(entries), n_batch):
+            chunk = entries[start:start + n_batch]
+            batch.n_tokens = len(chunk)
+            for i, (token, pos, seq_ids, seq) in enumerate(chunk):
+                batch.token[i] = token
+                batch.pos[i] = pos
+                batch.n_seq_id[i] = len(seq_ids)
+                for j, seq_id in enumerate(seq_ids):
+                    batch.seq_id[i][j] = seq_id
+                batch.logits[i] = seq is not None
+            if llama_cpp.llama_decode(ctx, batch) != 0:
+                raise RuntimeError("llama_decode failed")
+            for i, (_, _, _, seq) in enumerate(chunk):
+                if seq is not None:
+                    row = llama_cpp.llama_get_logits_ith(ctx, i)
+                    logits[seq] = np.ctypeslib.as_array(row, shape=(self.llm.n_vocab(),)).copy()
+        return logits
+
+    def _sample(self, logits, history, params, rng):
+        """Next token from logits: repeat penalty, then greedy, or top-k / top-p / min-p / temperature sampling"""
+        penalty = params["repeat_penalty"]
+        if penalty != 1.0:
+            recent = np.unique(np.asarray(history[-REPEAT_LAST_N:], dtype=np.int64))
+            selected = logits[recent]
+            logits[recent] = np.where(selected > 0, selected / penalty, selected * penalty)
+        if params["temperature"] <= 0:
+            return int(np.argmax(logits))
+
+        k = min(params["top_k"], len(logits)) if params["top_k"] > 0 else len(logits)
+        candidates = np.argpartition(logits, len(logits) - k)[len(logits) - k:]
+        candidates = candidates[np.argsort(-logits[candidates], kind="stable")]
+
+        def softmax(x):
+            e = np.exp(x - x.max())
+            return e / e.sum()
+
+        probs = softmax(logits[candidates])
+        candidates = candidates[:int(np.searchsorted(np.cumsum(probs), params["top_p"])) + 1]
+        probs = softmax(logits[candidates])
+        candidates = candidates[probs >= MIN_P * probs[0]]
+        probs = softmax(logits[candidates] / params["temperature"])
+        return int(rng.choice(candidates, p=probs))
+
+    def generate_batch(self, prompts, params=None):
+        """
+        Complete several prompts together, one sequence each in a single llama.cpp context.
+        Every step decodes the next token of all unfinished sequences in one llama_decode.
+        The token prefix the prompts share is evaluated once for all of them. Stop strings,
+        max_tokens and the end-of-sequence token end each sequence on its own, like __call__.
+        Greedy decoding gives the same answers as ask(); with sampling the sampler only
+        mirrors llama-cpp-python's default chain, with a generator per prompt derived from
+        the seed.
+        """
+        params = params or self._params()
+        start = time.perf_counter()
+        tokens = [self.llm.tokenize(p.encode("utf-8"), special=True) for p in prompts]
+        n = len(tokens)
+        shared = 0
+        limit = min(len(t) for t in tokens) - 1  # every sequence needs a token of its own for logits
+        while shared < limit and all(t[shared] == tokens[0][shared] for t in tokens):
+            shared += 1
+        max_tokens = params["max_tokens"]
+        self._batch_context(n, shared + sum(len(t) - shared + max_tokens for t in tokens))
+        llama_cpp.llama_kv_cache_clear(self._batch_ctx)
+
+        # the shared prefix belongs to every sequence, so its KV cells are shared too
+        everyone = list(range(n))
+        entries = [(token, pos, everyone, None) for pos, token in enumerate(tokens[0][:shared])]
+        for seq, t in enumerate(tokens):
+            entries += [(t[pos], pos, [seq], seq if pos == len(t) - 1 else None) for pos in range(shared, len(t))]
+        logits = self._decode(entries)
+
+        # one generator per sequence, seeded from the seed and its own prompt, so a sampled
+        # answer does not depend on which other prompts share the batch
+        rngs = [np.random.default_rng(None if params.get("seed") is None else
+                                      [params["seed"], int.from_bytes(hashlib.sha256(p.encode("utf-8")).digest()[:8], "little")])
+                for p in prompts]
+        eos = self.llm.token_eos()
+        history = [list(t) for t in tokens]
+        generated = [[] for _ in tokens]
+        texts = [""] * n
+        finish = [None] * n
+        active = everyone
+        while active:
+            step = []
+            for seq in active:
+                token = self._sample(logits[seq], history[seq], params, rngs[seq])
+                if token == eos:
+                    finish[seq] = "stop"
+                    continue
+                history[seq].append(token)
+                generated[seq].append(token)
+                text = self.llm.detokenize(generated[seq]).decode("utf-8", errors="ignore")
+                stops = [s for s in params["stop"] if s in text]
+                if stops:
+                    texts[seq] = text[:text.index(stops[0])]
+                    finish[seq] = "stop"
+                    continue
+                texts[seq] = text
+                if len(generated[seq]) >= max_tokens:
+                    finish[seq] = "length"
+                    continue
+                step.append((token, len(history[seq]) - 1, [seq], seq))
+            active = [entry[3] for entry in step]
+            if step:
+                logits = self._decode(step)
+
+        self.generation["batched"]["seconds"] += time.perf_counter() - start
+        self.generation["batched"]["tokens"] += sum(len(g) for g in generated)
+        return [[{"text": text, "index": 0, "logprobs": None, "finish_reason": reason}]
+                for text, reason in zip(texts, finish)]
+
+    def generation_stats(self):
+        """Generated tokens, seconds and tokens/s of the sequential and the batched path"""
+        return {
+            mode: dict(stats, tokens_per_second=stats["tokens"] / stats["seconds"] if stats["seconds"] else None)
+            for mode, stats in self.generation.items()
+        }
+
+    def benchmark_prefix(self, questions):
+        """
+        Time to first token of prompted questions with the whole prompt evaluated every
+        time and with the prefix state restored, and whether both gave the same answers
+        (only expected with deterministic decoding or a seed).
+        """
+        report = {}
+        answers = {}
+        for reuse in (False, True):
+            ttfts = []
+            texts = []
+            for question in questions:
+                if reuse:
+                    self._restore_prefix()
+                else:
+                    self.llm.reset()
+                start = time.perf_counter()
+                first = None
+                text = ""
+                for chunk in self.llm(PROMPT.format(question=question), stream=True, echo=False, **self._params()):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    text += chunk["choices"][0]["text"]
+                ttfts.append(first if first is not None else time.perf_counter() - start)
+                texts.append(text)
+            report["prefix_reused" if reuse else "full_prompt"] = {
+                "mean_ttft": statistics.mean(ttfts),
+                "p50_ttft": statistics.median(ttfts),
+            }
+            answers[reuse] = texts
+        report["ttft_speedup"] = report["full_prompt"]["mean_ttft"] / report["prefix_reused"]["mean_ttft"]
+        report["identical_answers"] = answers[False] == answers[True]
+        report["prefix_tokens"] = len(self._prefix_tokens)
+        return report
+
+    def benchmark_batch(self, questions, prompt=True):
+        """Tokens/s of ask() one question at a time against ask_batch(), and whether the answers agree"""
+        cache, self.cache = self.cache, None
+        self.generation = {"sequential": {"tokens": 0, "seconds": 0.0}, "batched": {"tokens": 0, "seconds": 0.0}}
+        sequential = [self.ask(question, prompt)[0]["text"] for question in questions]
+        batched = [choices[0]["text"] for choices in self.ask_batch(questions, prompt)]
+        self.cache = cache
+        report = self.generation_stats()
+        report["batch_size"] = self.batch_size
+        report["identical_answers"] = sequential == batched
+        return report
+
+
+def benchmark_draft(model_path, questions, draft, draft_tokens=10, prompt=True):
+    """Per-question latency of greedy ask() without and with speculative decoding, and whether the answers match"""
+    report = {}
+    answers = {}
+    for name, spec in (("baseline", None), ("speculative", draft)):
+        llm = LLM(model_path, cache_path=None, deterministic=True, draft=spec, draft_tokens=draft_tokens)
+        latencies = []
+        answers[name] = []
+        for question in questions:
+            start = time.perf_counter()
+            answers[name].append(llm.ask(question, prompt)[0]["text"])
+            latencies.append(time.perf_counter() - start)
+        report[name] = {"mean_seconds": statistics.mean(latencies), "p50_seconds": statistics.median(latencies),
+                        "latencies": latencies, "tokens_per_second": llm.generation_stats()["sequential"]["tokens_per_second"]}
+        del llm
+    report["speedup"] = report["baseline"]["mean_seconds"] / report["speculative"]["mean_seconds"]
+    report["identical_answers"] = answers["baseline"] == answers["speculative"]
+    return report
+
+
+def benchmark_runtime(model_path, questions, runtime):
+    """Load time, generation tokens/s and memory of one runtime profile (run it in a fresh process)"""
+    import resource
+
+    start = time.perf_counter()
+    llm = LLM(model_path, cache_path=None, deterministic=True, runtime=runtime)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = model_registry.rss_mb()
+    for question in questions:
+        llm.ask(question)
+    stats = llm.generation_stats()["sequential"]
+    return dict(runtime, load_seconds=load_seconds, tokens=stats["tokens"], tokens_per_second=stats["tokens_per_second"],
+                rss_after_load_mb=rss_loaded, peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def sweep(model_path, questions_path, grid, limit=5, workers=1):
+    """
+    benchmark_runtime() for every combination of grid ({setting: [values]}), each in its
+    own process so memory is measured from scratch. Returns one result per combination.
+    """
+    import itertools
+    import subprocess
+    import sys
+
+    results = []
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        runtime = runtime_profile(workers=workers, **dict(zip(keys, values)))
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--model", model_path, "--bench_runtime", json.dumps(runtime),
+             "--questions", questions_path, "--limit", str(limit)],
+            capture_output=True, text=True
+        )
+        lines = process.stdout.strip().splitlines()
+        if process.returncode == 0 and lines:
+            results.append(json.loads(lines[-1]))
+        else:
+            results.append(dict(runtime, error=process.stderr.strip().splitlines()[-1:]))
+        print(json.dumps(results[-1]))
+    return results
+
+
+def parse_grid(spec):
+    """"n_threads=4,8;use_mmap=true,false" -> {"n_threads": [4, 8], "use_mmap": [True, False]}"""
+    grid = {}
+    for item in filter(None, spec.split(";")):
+        key, _, values = item.partition("=")
+        grid[key.strip()] = [json.loads(value) for value in values.split(",")]
+    return grid
+
 if __name__=="__main__":
-    llm = LLM()
-    llm.ask("What is the capital of Italy?")
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="/home/user/models/llama-2-7b.Q4_K_M.gguf")
+    parser.add_argument("--bench_prefix",
+                        type=str,
+                        default=None,
+                        help="input file whose questions are used to measure the prompt prefix reuse")
+    parser.add_argument("--bench_batch",
+                        type=str,
+                        default=None,
+                        help="input file whose questions are used to compare batched and sequential generation")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--sweep",
+                        type=str,
+                        default=None,
+                        help="llama.cpp settings to sweep over --questions, e.g. 'n_threads=2,4,8;n_batch=128,512;use_mlock=false,true'")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes the thread counts are shared between")
+    parser.add_argument("--questions", type=str, default="/home/user/input_and_output/example_input.txt")
+    parser.add_argument("--draft",
+                        type=str,
+                        default="prompt-lookup",
+                        help="speculative decoding for --bench_draft: 'prompt-lookup' or a draft GGUF path")
+    parser.add_argument("--draft_tokens", type=int, default=10)
+    parser.add_argument("--bench_draft",
+                        type=str,
+                        default=None,
+                        help="input file whose questions are used to compare latency with and without --draft")
+    parser.add_argument("--bench_runtime", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bench_runtime:
+        from runner import iter_questions
+        questions = [question for _, question in iter_questions(args.questions)][:args.limit]
+        print(json.dumps(benchmark_runtime(args.model, questions, json.loads(args.bench_runtime))))
+    elif args.bench_draft:
+        from runner import iter_questions
+        questions = [question for _, question in iter_questions(args.bench_draft)][:args.limit]
+        print(json.dumps(benchmark_draft(args.model, questions, args.draft, args.draft_tokens), indent=2))
+    elif args.sweep:
+        sweep(args.model, args.questions, parse_grid(args.sweep), args.limit, args.workers)
+    elif args.bench_prefix:
+        from runner import iter_questions
+        llm = LLM(args.model, cache_path=None, deterministic=True)
+        questions = [question for _, question in iter_questions(args.bench_prefix)][:args.limit]
+        print(json.dumps(llm.benchmark_prefix(questions), indent=2))
+    elif args.bench_batch:
+        from runner import iter_questions
+        llm = LLM(args.model, cache_path=None, deterministic=True, batch_size=args.batch_size)
+        questions = [question for _, question in iter_questions(args.bench_batch)][:args.limit]
+        print(json.dumps(llm.benchmark_batch(questions), indent=2))
+    else:
+        llm = LLM(args.model)
+        llm.ask("What is the capital of Italy?")
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import tracing
+
+# Process-wide store of loaded models, so every component shares one copy
+_models = {}
+_lock = threading.Lock()
+
+# One entry per model actually loaded: {"model": ..., "seconds": ...}
+load_events = []
+
+
+def get_model(key, loader):
+    """Return the model registered under key, calling loader() only the first time."""
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        if key not in _models:
+            start = time.perf_counter()
+            _models[key] = loader()
+            seconds = time.perf_counter() - start
+            load_events.append({"model": str(key), "seconds": seconds})
+            tracing.event("model_load", model=str(key), seconds=seconds)
+            print(f"Loaded {key} in {seconds:.2f}s")
+    return _models[key]
+
+
+def get_loaded(key):
+    """The model registered under key if it has been loaded already, else None (never loads)"""
+    return _models.get(key)
+
+
+def available_cores():
+    """CPUs this process may use: its affinity mask, capped by a cgroup CPU quota (docker --cpus)"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def physical_cores():
+    """available_cores() without the SMT siblings, when SMT is on"""
+    cores = available_cores()
+    try:
+        with open("/sys/devices/system/cpu/smt/active") as f:
+            if f.read().strip() == "1":
+                return max(1, cores // 2)
+    except OSError:
+        pass
+    return cores
+
+
+def rss_mb():
+    """Current resident memory of this process in MB (None where /proc is not available)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def set_num_threads(num_threads):
+    """Size the torch intra-op thread pool (process-wide)."""
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+def get_sentence_transformer(name="all-distilroberta-v1", device=None, num_threads=None):
+    set_num_threads(num_threads)
+
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(name, device=device)
+
+    return get_model(("sentence_transformer", name, device), load)
+
+
+def get_boolq_predictor(model_path="yes_no_model.pkl", backend="torch"):
+    def load():
+        from judge import BoolQPredictor
+        return BoolQPredictor(model_path, backend=backend)
+
+    return get_model(("boolq", model_path, backend), load)
+
+
+def report():
+    """Print how long each model took to load"""
+    for event in load_events:
+        print(f"Model load: {event['model']} {event['seconds']:.2f}s")
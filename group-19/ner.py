@@ -1,17 +1,77 @@
-import spacy
+import json
+import sys
+import time
+from itertools import tee
+import model_registry
+import nlp_service
+import tracing
 
 class NER:
     def __init__(self, model="en_core_web_sm"):
-        self.model = spacy.load(model)
+        self.model_name = model
+        self.model = nlp_service.get_nlp(model)
     
+    @tracing.traced("ner.extract_entities")
     def extract_entities(self, text):
-        doc = self.model(text)
+        doc = nlp_service.parse(text, self.model_name, disable=nlp_service.NER_DISABLE)
         entities = []
         for ent in doc.ents:
             entities.append((ent.text, ent.label_))
         return entities
 
+    @tracing.traced("ner.extract_entities_batch")
+    def extract_entities_batch(self, texts, batch_size=64):
+        """Same as extract_entities for a list of texts, parsed together with nlp.pipe"""
+        return [
+            [(ent.text, ent.label_) for ent in doc.ents]
+            for doc in nlp_service.parse_batch(texts, self.model_name, disable=nlp_service.NER_DISABLE,
+                                               batch_size=batch_size)
+        ]
+
+    def stream_entities(self, texts, batch_size=256, n_process=1):
+        """
+        Yield (text, entities) for an iterable of texts, lazily and in input order, so
+        a large question file is never held in memory. Texts go through nlp.pipe
+        batch_size at a time; n_process > 1 spreads the batches over that many
+        processes (-1: every core available to this process). The Docs are not
+        kept in the nlp_service cache.
+        """
+        if n_process == -1:
+            n_process = model_registry.available_cores()
+        texts, copy = tee(texts)
+        docs = self.model.pipe(texts, batch_size=batch_size, n_process=n_process, disable=nlp_service.NER_DISABLE)
+        for text, doc in zip(copy, docs):
+            yield text, [(ent.text, ent.label_) for ent in doc.ents]
+
 if __name__=="__main__":
-    ner = NER()
-    entities = ner.extract_entities("Apple is a company based in Cupertino, California.")
-    print(entities)
\ No newline at end of file
+    import argparse
+    import runner
+
+    parser = argparse.ArgumentParser(description="Extract the entities of every question in a file")
+    parser.add_argument("--path", "-p", type=str, default=None,
+                        help="questions (id<TAB>question lines or a CSV with a question column); without it, run a small example")
+    parser.add_argument("--output", "-o", type=str, default=None, help="JSONL output, one line per question (default: stdout)")
+    parser.add_argument("--model", type=str, default="en_core_web_sm")
+    parser.add_argument("--batch_size", type=int, default=256, help="texts per nlp.pipe batch")
+    parser.add_argument("--n_process", type=int, default=1, help="processes for nlp.pipe (-1: all available cores)")
+    args = parser.parse_args()
+
+    ner = NER(args.model)
+    if args.path is None:
+        entities = ner.extract_entities("Apple is a company based in Cupertino, California.")
+        print(entities)
+    else:
+        questions, ids = tee(runner.iter_questions(args.path))
+        texts = (question.strip() for _, question in questions)
+        out = open(args.output, "w") if args.output else None
+        start = time.perf_counter()
+        n = 0
+        for (question_id, _), (text, entities) in zip(ids, ner.stream_entities(texts, args.batch_size, args.n_process)):
+            line = json.dumps({"id": question_id, "text": text, "entities": entities}, ensure_ascii=False)
+            print(line, file=out)
+            n += 1
+        if out:
+            out.close()
+        seconds = time.perf_counter() - start
+        # stderr, so stdout stays pure JSONL without --output
+        print(f"NER on {n} questions in {seconds:.1f}s ({n / seconds if seconds else 0:.1f} questions/s)", file=sys.stderr)
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+import model_registry
+import tracing
+
+# Shared spaCy models and parses. Every spaCy model is loaded once per process through
+# the model registry, and the Doc of each (model, text) is kept in a small LRU cache, so
+# the components that look at the same text (e.g. the fact checker's keywords and
+# entities of a question) parse it only once. Callers name the pipes they do not need
+# with `disable`; those are skipped for that call only (spaCy's per-call disable, which
+# leaves the shared pipeline untouched). The parses themselves are serialised, since a
+# spaCy pipeline is not meant to be run from several threads at once.
+# Docs from the cache are shared: read them, never modify them.
+
+DEFAULT_CACHE_SIZE = 1024
+
+# Pipes each consumer can skip
+NER_DISABLE = ("tagger", "parser", "attribute_ruler", "lemmatizer")
+POS_DISABLE = ("parser", "ner", "lemmatizer")
+SYNTAX_DISABLE = ("lemmatizer",)
+
+_docs = OrderedDict()
+_lock = threading.Lock()
+_parse_lock = threading.Lock()
+cache_size = DEFAULT_CACHE_SIZE
+hits = 0
+misses = 0
+
+
+def get_nlp(name="en_core_web_sm"):
+    """The spaCy pipeline `name`, loaded on first use and shared by every component"""
+    def load():
+        import spacy
+        return spacy.load(name)
+
+    return model_registry.get_model(("spacy", name), load)
+
+
+def _disabled(nlp, disable):
+    # only the pipes this model actually has, so the key does not depend on the model's extras
+    return tuple(sorted(set(disable) & set(nlp.pipe_names)))
+
+
+def _lookup(key):
+    global hits
+    with _lock:
+        doc = _docs.get(key)
+        if doc is not None:
+            _docs.move_to_end(key)
+            hits += 1
+    if doc is not None:
+        tracing.count("nlp_doc_hits")
+    return doc
+
+
+def _store(key, doc):
+    global misses
+    with _lock:
+        misses += 1
+        _docs[key] = doc
+        _docs.move_to_end(key)
+        while len(_docs) > cache_size:
+            _docs.popitem(last=False)
+    tracing.count("nlp_doc_misses")
+
+
+def parse(text, model="en_core_web_sm", disable=()):
+    """The Doc of text with model, without the pipes in disable; parsed once and then served from the cache"""
+    nlp = get_nlp(model)
+    disable = _disabled(nlp, disable)
+    key = (model, disable, text)
+    doc = _lookup(key)
+    if doc is None:
+        with _parse_lock:
+            doc = nlp(text, disable=disable)
+        _store(key, doc)
+    return doc
+
+
+def parse_batch(texts, model="en_core_web_sm", disable=(), batch_size=64):
+    """parse() for a list of texts, with the texts that are not cached yet parsed together with nlp.pipe"""
+    nlp = get_nlp(model)
+    disable = _disabled(nlp, disable)
+    keys = [(model, disable, text) for text in texts]
+    docs = [_lookup(key) for key in keys]
+    missing = list(dict.fromkeys(key[2] for key, doc in zip(keys, docs) if doc is None))
+    with _parse_lock:
+        parsed = dict(zip(missing, nlp.pipe(missing, batch_size=batch_size, disable=disable)))
+    for text, doc in parsed.items():
+        _store((model, disable, text), doc)
+    return [doc if doc is not None else parsed[key[2]] for key, doc in zip(keys, docs)]
+
+
+def configure(size=DEFAULT_CACHE_SIZE):
+    """Keep at most `size` Docs (0 turns the cache off)"""
+    global cache_size
+    with _lock:
+        cache_size = size
+        while len(_docs) > cache_size:
+            _docs.popitem(last=False)
+
+
+def stats():
+    with _lock:
+        return {"hits": hits, "misses": misses, "entries": len(_docs)}
@@ -0,0 +1,178 @@
+import os
+import re
+import tempfile
+import time
+import model_registry
+
+# Optional accelerated inference for the BERT-family models through ONNX Runtime.
+# Needs `pip install optimum[onnxruntime]`; the default "torch" backend does not.
+
+DEFAULT_ONNX_DIR = os.environ.get("WDPS_ONNX_DIR", os.path.expanduser("~/.cache/wdps/onnx"))
+BACKENDS = ("torch", "onnx", "onnx-int8")
+MODELS = ("el", "boolq", "qa")
+
+
+def parse_backends(spec):
+    """
+    "el=onnx-int8,qa=onnx" -> {"el": "onnx-int8", "boolq": "torch", "qa": "onnx"}
+    "onnx-int8" alone applies to every model.
+    """
+    backends = {model: "torch" for model in MODELS}
+    for item in filter(None, (spec or "").split(",")):
+        model, _, backend = item.rpartition("=")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if model and model not in MODELS:
+            raise ValueError(f"Unknown model {model!r}, expected one of {MODELS}")
+        for name in ([model] if model else MODELS):
+            backends[name] = backend
+    return backends
+
+
+def _ort_class(task):
+    from optimum import onnxruntime
+    return {
+        "feature-extraction": onnxruntime.ORTModelForFeatureExtraction,
+        "text-classification": onnxruntime.ORTModelForSequenceClassification,
+        "question-answering": onnxruntime.ORTModelForQuestionAnswering,
+    }[task]
+
+
+def load(source, task, backend, name=None, onnx_dir=DEFAULT_ONNX_DIR):
+    """
+    ONNX Runtime model for `source` (a hub name or a directory with a saved model),
+    exported once and kept under onnx_dir/name; with backend "onnx-int8" the weights
+    are also dynamically quantized to int8.
+    The returned model is called like the PyTorch one (outputs .logits, .last_hidden_state, ...).
+    """
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    cls = _ort_class(task)
+    name = name or re.sub(r"[^\w.-]", "_", source)
+    fp32_dir = os.path.join(onnx_dir, name, "fp32")
+    if not os.path.isfile(os.path.join(fp32_dir, "model.onnx")):
+        print(f"Exporting {source} to ONNX ({fp32_dir})")
+        cls.from_pretrained(source, export=True).save_pretrained(fp32_dir)
+    if backend == "onnx":
+        return cls.from_pretrained(fp32_dir)
+
+    int8_dir = os.path.join(onnx_dir, name, "int8")
+    if not os.path.isfile(os.path.join(int8_dir, "model_quantized.onnx")):
+        print(f"Quantizing {source} to int8 ({int8_dir})")
+        quantizer = ORTQuantizer.from_pretrained(fp32_dir)
+        quantizer.quantize(save_dir=int8_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=True))
+    return cls.from_pretrained(int8_dir, file_name="model_quantized.onnx")
+
+
+def load_from_model(model, tokenizer, task, backend, name, onnx_dir=DEFAULT_ONNX_DIR):
+    """load() for a model that only exists in memory (e.g. restored from a pickle)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        if not os.path.isfile(os.path.join(onnx_dir, name, "fp32", "model.onnx")):
+            model.save_pretrained(tmp)
+            tokenizer.save_pretrained(tmp)
+        return load(tmp, task, backend, name=name, onnx_dir=onnx_dir)
+
+
+QA_MODEL = "distilbert-base-cased-distilled-squad"
+
+
+def _load_for_parity(model, backend):
+    from entity_linking import EL
+    from judge import BoolQPredictor
+    from transformers import pipeline, AutoTokenizer
+
+    if model == "el":
+        return EL(disk_cache=False, backend=backend)
+    if model == "boolq":
+        return BoolQPredictor("yes_no_model.pkl", backend=backend)
+    if backend == "torch":
+        return pipeline("question-answering", model=QA_MODEL)
+    return pipeline("question-answering", model=load(QA_MODEL, "question-answering", backend),
+                    tokenizer=AutoTokenizer.from_pretrained(QA_MODEL))
+
+
+def _load_rss_mb(model, backend):
+    # runs in a fresh process: imports first, so only the model itself is measured
+    import gc
+    import entity_linking
+    import judge
+    import transformers
+    gc.collect()
+    before = model_registry.rss_mb()
+    loaded = _load_for_parity(model, backend)  # noqa: F841 (held until measured)
+    gc.collect()
+    return model_registry.rss_mb() - before
+
+
+def fresh_rss_mb(model, backend):
+    """
+    Memory one model takes when loaded in a new process. Any export has already happened
+    by then, so the ONNX figure no longer includes the PyTorch model it was exported from.
+    """
+    import multiprocessing
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_load_rss_mb, (model, backend))
+
+
+def parity_check(models, texts, backend="onnx-int8"):
+    """
+    Run the same inputs through the PyTorch and the ONNX Runtime path of each model and
+    report the largest output difference, whether the decisions agree, latency and memory
+    (each measured in a fresh load, see fresh_rss_mb).
+    """
+    import numpy as np
+
+    report = {}
+
+    def timed(fn):
+        start = time.perf_counter()
+        out = fn()
+        return out, time.perf_counter() - start
+
+    for model in models:
+        reference = _load_for_parity(model, "torch")
+        accelerated = _load_for_parity(model, backend)
+        if model == "el":
+            a, t_a = timed(lambda: reference._get_bert_embeddings(texts).numpy())
+            b, t_b = timed(lambda: accelerated._get_bert_embeddings(texts).numpy())
+            cosine = (a * b).sum(1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+            report[model] = {"min_cosine": float(cosine.min())}
+        elif model == "boolq":
+            a, t_a = timed(lambda: reference.predict_batch(texts, texts))
+            b, t_b = timed(lambda: accelerated.predict_batch(texts, texts))
+            report[model] = {
+                "answer_agreement": float(np.mean([x["answer"] == y["answer"] for x, y in zip(a, b)])),
+                "max_confidence_diff": max(abs(x["confidence"] - y["confidence"]) for x, y in zip(a, b)),
+            }
+        else:
+            contexts = [text + " " + text for text in texts]
+            a, t_a = timed(lambda: reference(question=texts, context=contexts))
+            b, t_b = timed(lambda: accelerated(question=texts, context=contexts))
+            a, b = (a, b) if isinstance(a, list) else ([a], [b])
+            report[model] = {"answer_agreement": float(np.mean([x["answer"] == y["answer"] for x, y in zip(a, b)]))}
+        del reference, accelerated
+        report[model].update({
+            "torch_seconds": t_a, "onnx_seconds": t_b,
+            "torch_rss_mb": fresh_rss_mb(model, "torch"), "onnx_rss_mb": fresh_rss_mb(model, backend),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Check the ONNX Runtime backend against PyTorch")
+    parser.add_argument("--path",
+                        "-p",
+                        type=str,
+                        default="/home/user/input_and_output/example_input.txt",
+                        help="input file whose questions are used as test inputs")
+    parser.add_argument("--models", type=str, default="el,boolq,qa", help="comma separated subset of el,boolq,qa")
+    parser.add_argument("--backend", type=str, choices=["onnx", "onnx-int8"], default="onnx-int8")
+    args = parser.parse_args()
+
+    with open(args.path) as f:
+        texts = [line.rstrip("\n").split("\t")[-1] for line in f if line.strip()]
+    print(json.dumps(parity_check(args.models.split(","), texts, args.backend), indent=2))
@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+import tracing
+
+# Stage-pipelined execution of Task: every stage runs on its own thread(s) with a
+# bounded queue in front of it, so llama.cpp can generate the answer of question N+1
+# while the candidates of question N are fetched and question N-1 is fact checked.
+# llama.cpp and torch release the GIL while they compute, and the knowledge base
+# stages mostly wait on the network, so the stages really do overlap.
+
+DEFAULT_THREADS = {"kb": 4}
+# Stages that may run on more than one thread. The others share state that is not
+# thread-safe: the llama.cpp context (llm), spaCy and the fast tokenizers of the BERT
+# models (ner, rank, extract). With --kb=ann the kb stage also embeds mentions with
+# EL's BERT model, whose tokenizer calls EL serialises.
+MULTI_THREADED = ("kb", "fact_check")
+_done = object()
+
+
+def parse_threads(spec):
+    """"kb=8,fact_check=2" -> {"kb": 8, "fact_check": 2}"""
+    threads = {}
+    for item in filter(None, (spec or "").split(",")):
+        name, _, count = item.partition("=")
+        threads[name] = int(count)
+    _check_threads(threads)
+    return threads
+
+
+def _check_threads(threads):
+    for name, count in threads.items():
+        if count < 1:
+            raise ValueError(f"Stage {name!r} needs at least one thread")
+        if count > 1 and name not in MULTI_THREADED:
+            raise ValueError(f"Stage {name!r} is not thread-safe and runs on one thread; "
+                             f"only {', '.join(MULTI_THREADED)} can have more")
+
+
+def task_stages(task, prompt=False):
+    """The steps of Task.run as (name, fn) pairs; each fn fills in its part of the state dict"""
+    def llm(state):
+        state["answer"] = task.llm.ask(state["question"], prompt)[0]['text']
+        print(state["answer"])
+
+    def ner(state):
+        # input both question and answer to NER
+        state["entities"] = task.ner.extract_entities(state["question"] + ". " + state["answer"])
+
+    def kb(state):
+        state["candidates"] = task.el.generate_candidates(state["entities"])
+
+    def rank(state):
+        linked = task.el.rank_candidates(state["answer"], state["candidates"])
+        state["linked"] = task.el.get_best_candidate(linked)
+
+    def extract(state):
+        state["extracted"] = task.ae.extract(state["question"], state["answer"], state["linked"])
+
+    def fact_check(state):
+        state["result"] = task._check(state["question"], state["answer"], state["linked"], state["extracted"])
+
+    return [("llm", llm), ("ner", ner), ("kb", kb), ("rank", rank), ("extract", extract), ("fact_check", fact_check)]
+
+
+class Stage:
+    """One pipeline stage: `threads` threads taking states from `inbox` and passing them to `outbox`"""
+    def __init__(self, name, fn, threads, inbox, outbox):
+        self.name = name
+        self.fn = fn
+        self.threads = threads
+        self.inbox = inbox
+        self.outbox = outbox
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self._running = threads
+        self._lock = threading.Lock()
+
+    def _loop(self):
+        while True:
+            depth = self.inbox.qsize()
+            state = self.inbox.get()
+            if state is _done:
+                break
+            if "trace" not in state:
+                # the first stage starts the trace, so it leaves out the wait for a queue slot
+                state["trace"] = tracing.begin(state["question_id"])
+            if "error" not in state:
+                start = time.perf_counter()
+                try:
+                    with tracing.activate(state["trace"]):
+                        self.fn(state)
+                except Exception as e:
+                    state["error"] = e
+                with self._lock:
+                    self.busy += time.perf_counter() - start
+                    self.items += 1
+                    self.errors += "error" in state
+                    self.depth_total += depth
+                    self.depth_max = max(self.depth_max, depth)
+            self.outbox.put(state)
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            # the last thread out tells every thread of the next stage to stop
+            for _ in range(self.next_threads):
+                self.outbox.put(_done)
+
+    def start(self, next_threads):
+        self.next_threads = next_threads
+        self.workers = [threading.Thread(target=self._loop, name=f"stage-{self.name}-{i}", daemon=True)
+                        for i in range(self.threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def stats(self, wall):
+        return {
+            "stage": self.name,
+            "threads": self.threads,
+            "items": self.items,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy, 2),
+            "utilisation": round(self.busy / (wall * self.threads), 3) if wall else 0.0,
+            "mean_queue_depth": round(self.depth_total / self.items, 2) if self.items else 0.0,
+            "max_queue_depth": self.depth_max,
+        }
+
+
+def run(task, questions, writer, prompt=False, queue_size=4, threads=None, report_every=0):
+    """
+    Answer (question_id, question) pairs with the stages of task_stages() running
+    concurrently, writing every result through writer as it completes (so not
+    necessarily in input order).
+    threads: stage name -> number of threads (default DEFAULT_THREADS, 1 for the rest);
+    report_every: seconds between printed queue depths (0 for none).
+    Returns the per-stage stats.
+    """
+    threads = {**DEFAULT_THREADS, **(threads or {})}
+    _check_threads(threads)
+    steps = task_stages(task, prompt)
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(steps) + 1)]
+    stages = [Stage(name, fn, threads.get(name, 1), queues[i], queues[i + 1]) for i, (name, fn) in enumerate(steps)]
+    for i, stage in enumerate(stages):
+        stage.start(stages[i + 1].threads if i + 1 < len(stages) else 1)
+
+    def feed():
+        try:
+            for question_id, question in questions:
+                queues[0].put({"question_id": question_id, "question": question})
+        finally:
+            for _ in range(stages[0].threads):
+                queues[0].put(_done)
+
+    start = time.perf_counter()
+    threading.Thread(target=feed, name="stage-input", daemon=True).start()
+    last_report = start
+    while True:
+        try:
+            state = queues[-1].get(timeout=1)
+        except queue.Empty:
+            state = None
+        if report_every and time.perf_counter() - last_report >= report_every:
+            last_report = time.perf_counter()
+            print("Pipeline queues: " + ", ".join(f"{s.name} {s.inbox.qsize()}" for s in stages))
+        if state is None:
+            continue
+        if state is _done:
+            break
+        tracing.finish(state["trace"])
+        result = state.get("error", state.get("result"))
+        writer.write_batch([state["question_id"]], [result])
+
+    wall = time.perf_counter() - start
+    return [stage.stats(wall) for stage in stages]
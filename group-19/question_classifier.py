@@ -1,13 +1,14 @@
 import re
-import spacy
+import nlp_service
 
 class Question_classifier:
     """
     use regex to classify question types:
     """
-    def __init__(self):
-        # Load the SpaCy English model
-        self.nlp = spacy.load("en_core_web_sm")
+    def __init__(self, model="en_core_web_sm"):
+        # The SpaCy English model, shared with NER through nlp_service
+        self.model = model
+        nlp_service.get_nlp(model)
         
         # Define WH-words and auxiliary verbs
         self.wh_words = {"what", "who", "where", "whom", "whose", "how", "which", "why", "when"}
@@ -92,8 +93,8 @@ class Question_classifier:
         if last_word in {"is", "are", "was", "were"} or '...' in question:
             return 2
 
-        # Parse the sentence with SpaCy and check for verbs
-        doc = self.nlp(question)
+        # Parse the sentence with SpaCy (POS tags only) and check for verbs
+        doc = nlp_service.parse(question, self.model, disable=nlp_service.POS_DISABLE)
         has_verb = any(token.pos_ in ["VERB", "AUX"] for token in doc)
         if not has_verb:
             return 2  # No verbs detected, classify as Category 2
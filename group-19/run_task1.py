@@ -3,15 +3,43 @@ from ner import NER
 from entity_linking import EL
 from answer_extract import Answer_extract
 from fact_checking import Fact_check
+import kb_cache
+import llm
+import model_registry
+import kb_backend
+import entity_index
+import onnx_backend
+import embedding_store
+import runner
+import worker_pool
+import pipeline
+import tracing
+import nlp_service
 import argparse
 
 class Task:
-    def __init__(self):
-        self.llm = LLM()
+    def __init__(self, device=None, num_threads=None, kb="wikipedia", local_kb=kb_backend.DEFAULT_LOCAL_PATH,
+                 entity_index_path=entity_index.DEFAULT_INDEX_PATH, backends=None,
+                 embedding_store=embedding_store.DEFAULT_STORE_PATH, llm=None):
+        """
+        backends: inference backend per BERT model, see onnx_backend.parse_backends
+        llm: anything with LLM's ask() (default: LLM())
+        """
+        backends = backends or onnx_backend.parse_backends("")
+        self.llm = llm or LLM()
         self.ner = NER()
-        self.el = EL()
-        self.ae = Answer_extract()
-        self.fc = Fact_check()
+        self.el = EL(backend=backends["el"])
+        if kb == "ann":
+            # dense retrieval embeds mentions with the same BERT the index was built with
+            encoder = lambda texts: self.el._get_bert_embeddings(texts).numpy()
+            backend = entity_index.AnnBackend(encoder, entity_index_path, local_kb)
+        else:
+            backend = kb_backend.get_backend(kb, local_kb)
+        self.el.source = backend
+        self.ae = Answer_extract(qa_backend=backends["qa"], boolq_backend=backends["boolq"])
+        self.fc = Fact_check(device=device, num_threads=num_threads, kb=backend, embedding_store=embedding_store)
+        # load the sentence encoder once at startup rather than on the first question
+        self.fc.warm_up()
 
     def run(self, question, prompt=False):
         answer = self.llm.ask(question, prompt)[0]['text']
@@ -30,7 +58,102 @@ class Task:
         # print(f"extracted_answer: {extracted_answer}\n")
         # print("\n\n\n\n\n\n\n\n\n\n\n\n\n")
         
+        return self._check(question, answer, linked_entities, extracted_answer)
+        # return answer, linked_entities
+
+    def run_batch(self, questions, prompt=False):
+        """
+        Run a list of questions stage by stage, so NER, BERT ranking, QA and yes/no
+        prediction each see the whole batch at once.
+        Returns one result per question, in order: the same tuple as run(), or the
+        exception raised while processing that question.
+        """
+        results = [None] * len(questions)
+        live = list(range(len(questions)))
+
+        def stage(fn, items):
+            # apply fn to every live question, dropping the ones that fail
+            out = {}
+            for i, item in zip(list(live), items):
+                try:
+                    out[i] = fn(*item)
+                except Exception as e:
+                    results[i] = e
+                    live.remove(i)
+            return out
+
+        def batched_stage(batch_fn, single_fn, items):
+            # one call for the whole batch; if it fails, retry one by one so a bad
+            # question only fails itself
+            items = list(items)
+            if not items:
+                return {}
+            try:
+                return dict(zip(live, batch_fn(*zip(*items))))
+            except Exception:
+                return stage(single_fn, items)
+
+        if getattr(self.llm, "batch_size", 1) > 1:
+            # several questions decoded together as parallel sequences of one llama.cpp context
+            answers = batched_stage(
+                lambda qs: [choices[0]['text'] for choices in self.llm.ask_batch(list(qs), prompt)],
+                lambda q: self.llm.ask(q, prompt)[0]['text'],
+                [(questions[i],) for i in live]
+            )
+        else:
+            answers = stage(lambda q: self.llm.ask(q, prompt)[0]['text'], [(questions[i],) for i in live])
+        for i in live:
+            print(answers[i])
+        # input both question and answer to NER
+        entities = batched_stage(
+            self.ner.extract_entities_batch,
+            self.ner.extract_entities,
+            [(questions[i] + ". " + answers[i],) for i in live]
+        )
+        candidates = stage(self.el.generate_candidates, [(entities[i],) for i in live])
+        linked = batched_stage(
+            self.el.rank_candidates_batch,
+            self.el.rank_candidates,
+            [(answers[i], candidates[i]) for i in live]
+        )
+        linked = {i: self.el.get_best_candidate(linked[i]) for i in live}
+
+        # task2
+        extracted = batched_stage(
+            self.ae.extract_batch,
+            self.ae.extract,
+            [(questions[i], answers[i], linked[i]) for i in live]
+        )
+
+        checked = batched_stage(
+            self._check_batch,
+            self._check,
+            [(questions[i], answers[i], linked[i], extracted[i]) for i in live]
+        )
+        for i in live:
+            results[i] = checked[i]
+        return results
+
+    def process(self, questions, prompt=False):
+        """run() for a single question, run_batch() for more; one result or exception per question"""
+        try:
+            if len(questions) == 1:
+                return [self.run(questions[0], prompt)]
+            return self.run_batch(list(questions), prompt)
+        except Exception as e:
+            return [e] * len(questions)
+
+    def _check(self, question, answer, linked_entities, extracted_answer):
         correctness = self.fc.fact_checking(question, extracted_answer, linked_entities, answer)
+        return self._result(answer, correctness, linked_entities, extracted_answer)
+
+    def _check_batch(self, questions, answers, linked, extracted):
+        """_check() for lists; a question whose check failed gets the exception as its result"""
+        checked = self.fc.fact_checking_batch(questions, extracted, linked, answers)
+        return [c if isinstance(c, Exception) else self._result(a, c, l, e)
+                for c, a, l, e in zip(checked, answers, linked, extracted)]
+
+    def _result(self, answer, correctness, linked_entities, extracted_answer):
         if correctness == 1:
             correctness = "correct"
         else:
@@ -44,7 +167,6 @@ class Task:
         else:
             extracted_answer = extracted_answer["linked_entity"]
         return answer, correctness, linked_entities, extracted_answer
-        # return answer, linked_entities
 
 
 if __name__ == "__main__":
@@ -54,7 +176,7 @@ if __name__ == "__main__":
                         "-p",
                         type=str,
                         default="/home/user/input_and_output/example_input.txt",
-                        help="the path of input file")
+                        help="the path of input file (question_id<TAB>question lines, or a .csv with a 'question' column)")
     parser.add_argument("--prompt",
                         type=bool,
                         default=False,
@@ -64,44 +186,208 @@ if __name__ == "__main__":
                         type=str,
                         default="/home/user/input_and_output/final_output.txt",
                         help="the path of output file")
-
+    parser.add_argument("--device",
+                        type=str,
+                        default=None,
+                        help="device for the sentence encoder, e.g. cpu or cuda (default: auto)")
+    parser.add_argument("--threads",
+                        type=int,
+                        default=None,
+                        help="number of torch threads to use (default: torch default, or cores / workers)")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=1,
+                        help="number of questions to run through each pipeline stage together")
+    parser.add_argument("--kb_cache",
+                        type=str,
+                        default=kb_cache.DEFAULT_PATH,
+                        help="the path of the knowledge base cache database")
+    parser.add_argument("--offline",
+                        action="store_true",
+                        help="only answer knowledge base lookups from the cache, never touch the network")
+    parser.add_argument("--kb",
+                        type=str,
+                        choices=["wikipedia", "wikidata", "local", "ann"],
+                        default="wikipedia",
+                        help="knowledge base for candidate generation and fact checking")
+    parser.add_argument("--local_kb",
+                        type=str,
+                        default=kb_backend.DEFAULT_LOCAL_PATH,
+                        help="the path of the local knowledge base built with kb_backend.py (used with --kb=local or ann)")
+    parser.add_argument("--entity_index",
+                        type=str,
+                        default=entity_index.DEFAULT_INDEX_PATH,
+                        help="the dense entity index built with entity_index.py (used with --kb=ann)")
+    parser.add_argument("--onnx",
+                        type=str,
+                        default="",
+                        help="run BERT models through ONNX Runtime, e.g. 'onnx-int8' for all of them or "
+                             "'el=onnx-int8,boolq=onnx,qa=torch' per model (needs optimum[onnxruntime])")
+    parser.add_argument("--embedding_store",
+                        type=str,
+                        default=embedding_store.DEFAULT_STORE_PATH,
+                        help="directory of the persistent sentence embedding store ('' to disable)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="number of worker processes forked after the models are loaded, sharing them")
+    parser.add_argument("--pipeline",
+                        action="store_true",
+                        help="run the stages concurrently with bounded queues between them, so network waits "
+                             "overlap with inference (results are written in completion order)")
+    parser.add_argument("--stage_threads",
+                        type=str,
+                        default="",
+                        help="threads per pipeline stage, e.g. 'kb=8,fact_check=2' "
+                             "(only kb and fact_check may have more than 1; default kb=4)")
+    parser.add_argument("--queue_size",
+                        type=int,
+                        default=4,
+                        help="capacity of the queue in front of each pipeline stage")
+    parser.add_argument("--pipeline_report",
+                        type=float,
+                        default=30,
+                        help="seconds between printed pipeline queue depths (0 to disable)")
+    parser.add_argument("--llm_model",
+                        type=str,
+                        default="/home/user/models/llama-2-7b.Q4_K_M.gguf",
+                        help="the GGUF model to answer with (e.g. another quantization)")
+    parser.add_argument("--llm_config",
+                        type=str,
+                        default=None,
+                        help="JSON file with llama.cpp settings (n_threads, n_threads_batch, n_batch, n_ctx, "
+                             "use_mmap, use_mlock); the --llm_* flags below override it")
+    parser.add_argument("--llm_threads",
+                        type=int,
+                        default=None,
+                        help="llama.cpp generation threads (default: physical cores / workers)")
+    parser.add_argument("--llm_ctx",
+                        type=int,
+                        default=None,
+                        help="llama.cpp context size in tokens (default 512)")
+    parser.add_argument("--llm_n_batch",
+                        type=int,
+                        default=None,
+                        help="llama.cpp prompt evaluation batch size (default 512)")
+    parser.add_argument("--no_mmap",
+                        action="store_true",
+                        help="read the model into memory instead of memory-mapping it")
+    parser.add_argument("--mlock",
+                        action="store_true",
+                        help="lock the model in RAM so it is never paged out")
+    parser.add_argument("--draft",
+                        type=str,
+                        default=None,
+                        help="speculative decoding: 'prompt-lookup' (n-grams from the prompt) or the path of a small "
+                             "draft GGUF with the same vocabulary; answers stay identical with --deterministic")
+    parser.add_argument("--draft_tokens",
+                        type=int,
+                        default=10,
+                        help="number of tokens proposed per speculative step")
+    parser.add_argument("--llm_cache",
+                        type=str,
+                        default=llm.DEFAULT_CACHE_PATH,
+                        help="the path of the persistent LLM response cache ('' to disable); "
+                             "only used with --deterministic or --seed")
+    parser.add_argument("--deterministic",
+                        action="store_true",
+                        help="greedy LLM decoding (temperature 0), so answers are reproducible and can be cached")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=None,
+                        help="fixed LLM sampling seed, so answers are reproducible and can be cached")
+    parser.add_argument("--llm_batch_size",
+                        type=int,
+                        default=1,
+                        help="number of questions the LLM generates together as parallel sequences "
+                             "(used with --batch_size of at least this size)")
+    parser.add_argument("--no_prefix_reuse",
+                        action="store_true",
+                        help="evaluate the whole prompt for every question instead of restoring the "
+                             "llama.cpp state of the fixed prompt prefix")
+    parser.add_argument("--trace",
+                        type=str,
+                        default=None,
+                        help="JSONL file for the per-question trace, with the p50/p95/p99 summary next to it "
+                             "(default: output + '.trace.jsonl', '' to only print the summary)")
+    parser.add_argument("--checkpoint",
+                        type=str,
+                        default=None,
+                        help="file of finished question ids used to resume an interrupted run (default: output + '.ckpt')")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="skip the questions the checkpoint lists as done and append to the output "
+                             "(default: start over and overwrite the output)")
+    parser.add_argument("--flush_every",
+                        type=int,
+                        default=1,
+                        help="number of finished questions to buffer before flushing the output and checkpoint")
 
     # Parse command line arguments
     args = parser.parse_args()
+    if args.pipeline and args.workers > 1:
+        parser.error("--pipeline and --workers run in one process and are not combined")
+    try:
+        stage_threads = pipeline.parse_threads(args.stage_threads)
+    except ValueError as e:
+        parser.error(str(e))
     input_path = args.path
     prompt = args.prompt
     output_path = args.output
+    batch_size = max(1, args.batch_size)
+    if args.trace is None:
+        args.trace = output_path + ".trace.jsonl"
+    kb_cache.configure(path=args.kb_cache, offline=args.offline or None)
 
-    task = Task()
-        
-    # Read input file
-    with open(input_path, "r") as file:
-        questions = file.readlines()
+    # the workers share the cores, so each llama.cpp instance gets its part of them
+    runtime = llm.runtime_profile(workers=max(1, args.workers), config=args.llm_config, n_threads=args.llm_threads,
+                                  n_ctx=args.llm_ctx, n_batch=args.llm_n_batch,
+                                  use_mmap=False if args.no_mmap else None, use_mlock=True if args.mlock else None)
+    print(f"llama.cpp runtime: {runtime}")
+    task = Task(device=args.device, num_threads=args.threads, kb=args.kb, local_kb=args.local_kb,
+                entity_index_path=args.entity_index, backends=onnx_backend.parse_backends(args.onnx),
+                embedding_store=args.embedding_store or None,
+                llm=LLM(args.llm_model, cache_path=args.llm_cache, deterministic=args.deterministic, seed=args.seed,
+                        reuse_prefix=not args.no_prefix_reuse, batch_size=max(1, args.llm_batch_size),
+                        runtime=runtime, draft=args.draft, draft_tokens=args.draft_tokens))
+    writer = runner.ResultWriter(output_path, args.checkpoint, resume=args.resume,
+                                flush_every=args.flush_every, input_path=input_path)
 
-    for question in questions:
-        if question.strip() == "":
-            continue
+    # Read input lazily and skip questions finished by an earlier, interrupted run
+    questions = (item for item in runner.iter_questions(input_path) if not writer.done(item[0]))
 
-        try:
-            question_id = question.split("\t")[0]
-            question_text = question.split("\t")[1]
-
-            # run task
-            answer, correctness, result, extracted_answer = task.run(question_text, prompt)
-
-            # write to output file
-            with open(output_path, "a") as file:
-                file.write(f"{question_id}\tR\"{answer}\"\n")
-                file.write(f"{question_id}\tA\"{extracted_answer}\"\n")
-                file.write(f"{question_id}\tC\"{correctness}\"\n")
-                for key, value in result.items():
-                    file.write(f"{question_id}\tE\"{key}\"\t\"{value['wikidata_url']}\"\n")
-
-        except Exception as e:
-            # catch exception and print error message
-            error_message = f"Error processing question ID {question_id}: {str(e)}\n"
-            print(error_message)
+    if args.pipeline:
+        for stats in pipeline.run(task, questions, writer, prompt, args.queue_size,
+                                  stage_threads, args.pipeline_report):
+            print(f"Stage: {stats}")
+    elif args.workers > 1:
+        worker_stats = worker_pool.run(task, questions, writer, args.workers, batch_size, prompt, args.threads)
+        for stats in worker_stats:
+            print(f"Worker: {stats}")
+    else:
+        for batch in runner.batched(questions, batch_size):
+            question_ids, question_texts = zip(*batch)
+            with tracing.question(question_ids[0] if len(question_ids) == 1 else list(question_ids)):
+                results = task.process(question_texts, prompt)
+            writer.write_batch(question_ids, results)
 
+    writer.close()
+    model_registry.report()
+    if args.workers > 1 and not args.pipeline:
+        # the questions ran in the workers, whose counters only come back through their stats
+        totals = worker_pool.cache_totals(worker_stats)
+        print(f"Knowledge base cache: hits {totals['kb_cache_hits']}, misses {totals['kb_cache_misses']}")
+        if task.llm.cache_stats() is not None:
+            print(f"LLM response cache: hits {totals['llm_cache_hits']}, misses {totals['llm_cache_misses']}")
+    else:
+        print(f"Knowledge base cache: {kb_cache.get_cache().stats()}")
+        print(f"LLM response cache: {task.llm.cache_stats()}")
+        print(f"spaCy parse cache: {nlp_service.stats()}")
+        print(f"LLM generation: {task.llm.generation_stats()}")
+    if tracing.records:
+        summary = tracing.write(args.trace) if args.trace else tracing.summary()
+        tracing.print_summary(summary)
+    print(f"Yes/no predictor: {task.ae.predictor_stats()}")
 
     # while True:
     #     print("Please input your question:")
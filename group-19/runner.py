@@ -0,0 +1,142 @@
+import csv
+import os
+import sys
+from itertools import islice
+
+
+def iter_questions(path):
+    """
+    Yield (question_id, question_text) from an input file without reading it all.
+    Text files have one "question_id<TAB>question" per line; .csv files (like
+    combined_questions.csv) use the "question" column and get ids from the row number.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="") as file:
+            for n, row in enumerate(csv.DictReader(file), 1):
+                question = (row.get("question") or "").strip()
+                if question:
+                    yield f"question-{n:06d}", question
+        return
+
+    with open(path, "r") as file:
+        for question in file:
+            if question.strip() == "":
+                continue
+            if "\t" not in question:
+                print(f"Skipping line without a tab: {question.rstrip()!r}", file=sys.stderr)
+                continue
+            question_id, question = question.split("\t")[:2]
+            yield question_id, question
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _input_signature(input_path):
+    """Checkpoint header identifying the input file, so a checkpoint is never applied to another input"""
+    if input_path is None:
+        return "#input"
+    stat = os.stat(input_path)
+    return f"#input\t{os.path.abspath(input_path)}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+
+class ResultWriter:
+    """
+    Writes results through one buffered file handle and keeps a checkpoint of finished
+    question ids next to the output (output + ".ckpt").
+
+    The checkpoint starts with a "#input" line naming the input file with its size and
+    modification time; every other line is "question_id<TAB>byte offset of the output
+    after its lines", written only after those lines were flushed. On resume the output
+    is cut back to the last checkpointed offset, which drops a question that was
+    interrupted halfway, and finished ids are skipped, so nothing is run or written
+    twice. Without a checkpoint, or with one made for another input, the run starts
+    over and the output is overwritten.
+    """
+    def __init__(self, output_path, checkpoint_path=None, resume=False, flush_every=1, input_path=None):
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or output_path + ".ckpt"
+        self.flush_every = flush_every
+        self.finished = set()
+        self._pending = []
+        signature = _input_signature(input_path)
+
+        offset = None
+        if resume and os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                header = checkpoint.readline().rstrip("\n")
+                if header == signature:
+                    offset = 0
+                    for line in checkpoint:
+                        parts = line.rstrip("\n").split("\t")
+                        if len(parts) == 2:
+                            self.finished.add(parts[0])
+                            offset = int(parts[1])
+                else:
+                    print(f"{self.checkpoint_path} was written for another input, starting over")
+
+        directory = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(directory, exist_ok=True)
+        self._output = open(output_path, "a+b")
+        if self._output.seek(0, os.SEEK_END) > (offset or 0):
+            self._output.truncate(offset or 0)
+            self._output.seek(0, os.SEEK_END)
+        self._checkpoint = open(self.checkpoint_path, "a" if offset is not None else "w")
+        if offset is None:
+            self._checkpoint.write(signature + "\n")
+            self._checkpoint.flush()
+        if self.finished:
+            print(f"Resuming: {len(self.finished)} questions already done")
+
+    def done(self, question_id):
+        return question_id in self.finished
+
+    def write(self, question_id, result):
+        answer, correctness, linked_entities, extracted_answer = result
+        lines = [
+            f"{question_id}\tR\"{answer}\"\n",
+            f"{question_id}\tA\"{extracted_answer}\"\n",
+            f"{question_id}\tC\"{correctness}\"\n",
+        ]
+        for key, value in linked_entities.items():
+            lines.append(f"{question_id}\tE\"{key}\"\t\"{value['wikidata_url']}\"\n")
+        self._output.write("".join(lines).encode("utf-8"))
+        self._pending.append(question_id)
+        self.finished.add(question_id)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def write_batch(self, question_ids, results):
+        """write() every result, printing the error of questions that failed instead"""
+        for question_id, result in zip(question_ids, results):
+            if isinstance(result, Exception):
+                # catch exception and print error message
+                error_message = f"Error processing question ID {question_id}: {str(result)}\n"
+                print(error_message)
+                continue
+            self.write(question_id, result)
+
+    def flush(self):
+        self._output.flush()
+        offset = self._output.tell()
+        for question_id in self._pending:
+            self._checkpoint.write(f"{question_id}\t{offset}\n")
+        self._checkpoint.flush()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._output.close()
+        self._checkpoint.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,78 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+_token_pattern = re.compile(r"\w+")
+
+
+class ArticleIndex:
+    """
+    Sentences of one article with a lowercase token -> sentence ids inverted index.
+    find(keyword) returns exactly the sentences that contain keyword case-insensitively
+    (the old full-text substring scan), but only looks at sentences sharing its tokens.
+    Tokens that only partly match a keyword token (prefix, suffix or infix) are found by
+    binary search in sorted lists of the vocabulary, its reversed tokens and all token
+    suffixes, built on first use, instead of scanning the vocabulary.
+    """
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self._lowered = [sentence.lower() for sentence in sentences]
+        postings = defaultdict(set)
+        for i, sentence in enumerate(self._lowered):
+            for token in _token_pattern.findall(sentence):
+                postings[token].add(i)
+        self.postings = dict(postings)
+        self._results = {}
+        self._lookups = {}
+
+    def _sorted(self, name, keys):
+        # (sorted keys, token of each key), built once per kind of lookup
+        lookup = self._lookups.get(name)
+        if lookup is None:
+            pairs = sorted(keys)
+            lookup = self._lookups[name] = ([key for key, _ in pairs], [token for _, token in pairs])
+        return lookup
+
+    def _with_prefix(self, lookup, prefix):
+        keys, tokens = lookup
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "\uffff")
+        ids = set()
+        for token in tokens[start:end]:
+            ids |= self.postings[token]
+        return ids
+
+    def _containing(self, part):
+        # a token contains part iff one of its suffixes starts with it
+        return self._with_prefix(self._sorted("suffixes", (
+            (token[i:], token) for token in self.postings for i in range(len(token))
+        )), part)
+
+    def _ending_with(self, part):
+        return self._with_prefix(self._sorted("reversed", ((token[::-1], token) for token in self.postings)), part[::-1])
+
+    def _starting_with(self, part):
+        return self._with_prefix(self._sorted("tokens", ((token, token) for token in self.postings)), part)
+
+    def _candidates(self, tokens):
+        if len(tokens) == 1:
+            # a single token may sit inside a longer word ("art" in "start")
+            return self._containing(tokens[0])
+        # the first token may end a longer word and the last may start one;
+        # tokens in between must be whole words
+        ids = self._ending_with(tokens[0])
+        for token in tokens[1:-1]:
+            ids &= self.postings.get(token, set())
+            if not ids:
+                return ids
+        return ids & self._starting_with(tokens[-1])
+
+    def find(self, keyword):
+        keyword = keyword.lower()
+        if keyword not in self._results:
+            tokens = _token_pattern.findall(keyword)
+            candidates = self._candidates(tokens) if tokens else range(len(self.sentences))
+            self._results[keyword] = [
+                self.sentences[i] for i in sorted(candidates) if keyword in self._lowered[i]
+            ]
+        return self._results[keyword]
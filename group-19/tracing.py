@@ -0,0 +1,191 @@
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight per-question tracing. A Trace collects the spans (wall and CPU time of
+# each traced call), counters (network calls, cache hits/misses) and events (model
+# loads) of one question, or of one batch of questions. The current trace lives in a
+# context variable, so anything called while a question runs adds to that question's
+# trace; use wrap() to carry it into thread pool tasks.
+# CPU time is process CPU time, so with several questions in flight at once it also
+# includes the work of the others.
+
+_current = contextvars.ContextVar("trace", default=None)
+_lock = threading.Lock()
+records = []
+
+
+class Trace:
+    def __init__(self, question_id):
+        self.question_id = question_id
+        self.spans = []
+        self.counters = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def to_dict(self):
+        return {
+            "question_id": self.question_id,
+            "wall": time.perf_counter() - self._start,
+            "cpu": time.process_time() - self._cpu_start,
+            "spans": self.spans,
+            "counters": self.counters,
+            "events": self.events,
+        }
+
+
+def begin(question_id):
+    """A new trace for question_id (a question id or a list of them for a batch)"""
+    return Trace(question_id)
+
+
+@contextmanager
+def activate(trace):
+    """Make trace the current trace inside the block"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def finish(trace):
+    record = trace.to_dict()
+    with _lock:
+        records.append(record)
+    return record
+
+
+@contextmanager
+def question(question_id):
+    """Trace everything done inside the block for question_id"""
+    trace = begin(question_id)
+    try:
+        with activate(trace):
+            yield trace
+    finally:
+        finish(trace)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        entry = {"name": name, "wall": time.perf_counter() - start, "cpu": time.process_time() - cpu_start}
+        with trace._lock:
+            trace.spans.append(entry)
+
+
+def traced(name):
+    """Decorator recording a span for every call"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.counters[name] = trace.counters.get(name, 0) + n
+
+
+def event(name, **data):
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.events.append({"event": name, **data})
+
+
+def wrap(fn):
+    """fn bound to the current context, for submitting to a thread pool"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def drain():
+    """Remove and return the finished records (e.g. to send them to another process)"""
+    global records
+    with _lock:
+        drained, records = records, []
+    return drained
+
+
+def add(new_records):
+    with _lock:
+        records.extend(new_records)
+
+
+def _percentile(values, q):
+    # nearest-rank percentile of sorted values
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summary(trace_records=None):
+    """Per span name and for whole questions: count, mean and p50/p95/p99 of wall and CPU seconds, plus counter totals"""
+    trace_records = records if trace_records is None else trace_records
+    samples = {"question": [(r["wall"], r["cpu"]) for r in trace_records]}
+    counters = {}
+    for record in trace_records:
+        for entry in record["spans"]:
+            samples.setdefault(entry["name"], []).append((entry["wall"], entry["cpu"]))
+        for name, n in record["counters"].items():
+            counters[name] = counters.get(name, 0) + n
+
+    stages = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        stats = {"count": len(values)}
+        for i, kind in enumerate(("wall", "cpu")):
+            column = sorted(v[i] for v in values)
+            stats[kind] = {
+                "mean": sum(column) / len(column),
+                "p50": _percentile(column, 50),
+                "p95": _percentile(column, 95),
+                "p99": _percentile(column, 99),
+            }
+        stages[name] = stats
+    return {"stages": stages, "counters": counters,
+            "model_loads": sum(len(r["events"]) for r in trace_records)}
+
+
+def write(path, trace_records=None):
+    """Write one JSON line per trace to path and the summary to path + ".summary.json"; returns the summary"""
+    trace_records = records if trace_records is None else trace_records
+    with open(path, "w") as f:
+        for record in trace_records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    result = summary(trace_records)
+    with open(path + ".summary.json", "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def print_summary(result):
+    for name, stats in result["stages"].items():
+        wall = stats["wall"]
+        print(f"{name:28s} n={stats['count']:<5d} p50={wall['p50']:.3f}s p95={wall['p95']:.3f}s "
+              f"p99={wall['p99']:.3f}s cpu_p50={stats['cpu']['p50']:.3f}s")
+    print(f"Counters: {result['counters']}, model loads: {result['model_loads']}")
@@ -0,0 +1,130 @@
+import gc
+import multiprocessing
+import os
+import queue
+import time
+from itertools import chain
+import kb
+import kb_cache
+import model_registry
+import tracing
+from runner import batched
+
+# Parallelism inside one process tree instead of one container per input shard.
+# The parent loads every model once and then forks the workers: the llama.cpp
+# weights are mmapped and the torch weights are copy-on-write, so workers share
+# them instead of each holding its own copy. Workers pull batches from one queue,
+# so a slow batch only delays the worker that has it. The knowledge base lookups
+# inside each worker already run on kb's thread pools.
+
+
+def _worker(task, tasks, results, prompt, num_threads, kb_rate):
+    model_registry.set_num_threads(num_threads)
+    # the workers share the knowledge base rate limit between them
+    kb.rate_limiter = kb.TokenBucket(rate=kb_rate, capacity=kb.rate_limiter.capacity)
+    # the counters are inherited from the parent, so only what this worker adds is reported
+    before = _cache_counts(task)
+    questions = 0
+    busy = 0.0
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        question_ids, question_texts = zip(*batch)
+        start = time.perf_counter()
+        with tracing.question(question_ids[0] if len(question_ids) == 1 else list(question_ids)):
+            out = task.process(question_texts, prompt)
+        busy += time.perf_counter() - start
+        questions += len(batch)
+        # exceptions do not always pickle, so only their message goes back
+        out = [RuntimeError(str(r)) if isinstance(r, Exception) else r for r in out]
+        results.put(("result", question_ids, out, tracing.drain()))
+    after = _cache_counts(task)
+    results.put(("done", {
+        "pid": os.getpid(),
+        "questions": questions,
+        "busy_seconds": round(busy, 2),
+        **{name: after[name] - before[name] for name in after},
+        "yes_no": task.ae.predictor_stats(),
+    }))
+
+
+def _cache_counts(task):
+    cache = kb_cache.get_cache()
+    llm_cache = getattr(task.llm, "cache_stats", lambda: None)() or {"hits": 0, "misses": 0}
+    return {
+        "kb_cache_hits": cache.hits,
+        "kb_cache_misses": cache.misses,
+        "llm_cache_hits": llm_cache["hits"],
+        "llm_cache_misses": llm_cache["misses"],
+    }
+
+
+def cache_totals(stats):
+    """Cache hits and misses of all workers added up (the parent's own counters stay at what it did itself)"""
+    names = ("kb_cache_hits", "kb_cache_misses", "llm_cache_hits", "llm_cache_misses")
+    return {name: sum(worker.get(name, 0) for worker in stats) for name in names}
+
+
+def run(task, questions, writer, workers, batch_size=1, prompt=False, num_threads=None):
+    """
+    Answer (question_id, question) pairs with `workers` processes forked from this one,
+    writing every result through writer as it arrives.
+    num_threads is the torch thread count of each worker (default: cores / workers).
+    Returns one stats dict per worker.
+    """
+    # load everything that is loaded lazily, so the workers inherit it instead of loading it again
+    task.ae.predictor
+    num_threads = num_threads or max(1, model_registry.available_cores() // workers)
+    kb_rate = kb.rate_limiter.rate / workers
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    context = multiprocessing.get_context("fork")
+    tasks = context.Queue(maxsize=workers * 2)
+    results = context.Queue()
+    # keep the garbage collector from touching (and so copying) the inherited objects
+    gc.freeze()
+    processes = [
+        context.Process(target=_worker, args=(task, tasks, results, prompt, num_threads, kb_rate), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # every worker stops at the None after the last batch
+    items = chain(batched(questions, batch_size), [None] * workers)
+    pending = next(items, None)
+    feeding = True
+    stats = {}
+    while len(stats) < len(processes):
+        # keep the queue topped up without ever blocking on it
+        while feeding:
+            try:
+                tasks.put_nowait(pending)
+            except queue.Full:
+                break
+            pending = next(items, StopIteration)
+            feeding = pending is not StopIteration
+
+        try:
+            message = results.get(timeout=1)
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode not in (None, 0) and process.pid not in stats:
+                    # its batch is not checkpointed, so the next run retries it
+                    print(f"Worker {process.pid} died with exit code {process.exitcode}")
+                    stats[process.pid] = {"pid": process.pid, "exitcode": process.exitcode}
+            if all(process.exitcode is not None for process in processes) and results.empty():
+                break
+            continue
+
+        if message[0] == "result":
+            writer.write_batch(message[1], message[2])
+            tracing.add(message[3])
+        else:
+            stats[message[1]["pid"]] = message[1]
+
+    for process in processes:
+        process.join(timeout=5)
+    gc.unfreeze()
+    return list(stats.values())
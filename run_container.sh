@@ -1,29 +1,18 @@
 #!/bin/bash
 
-# 检查输入参数
-if [ $# -eq 0 ]; then
-  PARALLEL_INSTANCES=1  # 默认并行实例数量
-else
-  # 解析 --parall 参数
-  for ARG in "$@"; do
-    case $ARG in
-      --parall=*)
-        PARALLEL_INSTANCES="${ARG#*=}"
-        shift
-        ;;
-      *)
-        echo "Unknown argument: $ARG"
-        exit 1
-        ;;
-    esac
-  done
-fi
-
-# 限制实例数量为 1 到 4
-if [ "$PARALLEL_INSTANCES" -lt 1 ] || [ "$PARALLEL_INSTANCES" -gt 4 ]; then
-  echo "Error: parallel_instances must be between 1 and 4."
-  exit 1
-fi
+# 只启动一个容器：并行由 run_task1.py 的 worker 进程完成（run_program.sh --parall=N）
+PARALLEL_INSTANCES=1
+for ARG in "$@"; do
+  case $ARG in
+    --parall=*)
+      echo "Note: --parall is now handled by run_program.sh as worker processes in one container."
+      ;;
+    *)
+      echo "Unknown argument: $ARG"
+      exit 1
+      ;;
+  esac
+done
 
 # 初始化缓存卷
 echo "Initializing cache volume..."